@@ -1,14 +1,19 @@
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import AsyncIterator, List, Optional, Dict, Iterator
+import orjson
 import os
+import asyncio
 from dotenv import load_dotenv
 import logging
 
 # Import our services
 from app.services.llm_service import LLMService
-from app.services.data_processor import DataProcessor
+from app.services.data_processor import DataProcessor, BufferedProcessedStore
+from app.services.response_cache import ResponseCache
+from app.services.async_batcher import AsyncBatcher
 from app.scrapers.lexicanum_scraper import LexicanumScraper
 from app.models.database import get_db, create_tables
 
@@ -16,13 +21,23 @@ from app.models.database import get_db, create_tables
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
+# Load environment variables, unless they are injected directly (SKIP_DOTENV=1)
+if os.getenv("SKIP_DOTENV") != "1":
+    load_dotenv()
 
 # Initialize services
-llm_service = LLMService()
+llm_service = LLMService(
+    cache_path=os.path.join("data", "semantic_cache.pkl"),
+    index_path=os.path.join("data", "kb_index")
+)
 data_processor = DataProcessor()
 scraper = LexicanumScraper()
+processed_store = BufferedProcessedStore(data_processor, "processed_data_latest.json")
+response_cache = ResponseCache()
+# Questions arriving within 20 ms of each other are sent to the LLM together, up to 16 at a time
+answer_batcher = AsyncBatcher(
+    lambda request: llm_service.agenerate_enhanced_answer(*request), max_batch=16, batch_timeout=0.02
+)
 
 # Create database tables
 create_tables()
@@ -30,7 +45,8 @@ create_tables()
 app = FastAPI(
     title="Warhammer 40K Lore Assistant",
     description="An LLM-powered assistant for Warhammer 40K lore questions",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware for frontend integration
@@ -76,46 +92,102 @@ async def health_check():
     return {"status": "healthy"}
 
 # Question answering endpoint
-@app.post("/ask", response_model=AnswerResponse)
+# AnswerResponse documents the schema only; responses are built server-side and
+# returned directly so they skip response-model validation and re-encoding
+@app.post("/ask", response_model=None, responses={200: {"model": AnswerResponse}})
 async def ask_question(request: QuestionRequest):
     """
     Answer a question about Warhammer 40K lore using scraped Lexicanum data
     """
     try:
         # Load processed data (in production, this would be from database)
-        processed_data = data_processor.load_processed_data("processed_data_latest.json")
+        processed_data = await asyncio.to_thread(data_processor.load_processed_data, "processed_data_latest.json")
         
         if not processed_data:
             # Fallback to basic response if no data available
-            return AnswerResponse(
-                answer="I don't have access to the Lexicanum data yet. Please run the scraping process first to populate the knowledge base.",
-                sources=["https://wh40k.lexicanum.com/wiki/Main_Page"],
-                confidence=0.1
-            )
+            return ORJSONResponse({
+                "answer": "I don't have access to the Lexicanum data yet. Please run the scraping process first to populate the knowledge base.",
+                "sources": ["https://wh40k.lexicanum.com/wiki/Main_Page"],
+                "confidence": 0.1
+            })
+        
+        # Serve repeated questions against the same corpus from the cache. The stat and the
+        # Redis round trips block, so they run off the event loop like the other I/O here
+        data_version = await asyncio.to_thread(data_processor.data_version, "processed_data_latest.json")
+        cache_key = response_cache.make_key("ask", request.question, data_version)
+        cached = await asyncio.to_thread(response_cache.get, cache_key)
+        if cached:
+            return Response(content=cached, media_type="application/json")
         
         # Find relevant context
-        context = llm_service.find_relevant_context(request.question, processed_data)
+        context = await asyncio.to_thread(llm_service.find_relevant_context, request.question, processed_data)
         
         if not context:
-            return AnswerResponse(
-                answer="I couldn't find relevant information in the knowledge base to answer your question. The knowledge base might need to be updated with more data.",
-                sources=["https://wh40k.lexicanum.com/wiki/Main_Page"],
-                confidence=0.2
-            )
+            return ORJSONResponse({
+                "answer": "I couldn't find relevant information in the knowledge base to answer your question. The knowledge base might need to be updated with more data.",
+                "sources": ["https://wh40k.lexicanum.com/wiki/Main_Page"],
+                "confidence": 0.2
+            })
         
-        # Generate answer using LLM
-        result = llm_service.generate_enhanced_answer(request.question, context)
+        # Generate answer using LLM; awaiting it lets other questions proceed meanwhile
+        result = await answer_batcher.submit((request.question, context))
         
-        return AnswerResponse(
-            answer=result["answer"],
-            sources=result["sources"],
-            confidence=result["confidence"]
-        )
+        body = orjson.dumps({
+            "answer": result["answer"],
+            "sources": result["sources"],
+            "confidence": result["confidence"]
+        })
+        
+        # Errors and an unconfigured LLM report zero confidence; don't cache those
+        if result["confidence"] > 0:
+            await asyncio.to_thread(response_cache.set, cache_key, body)
+        
+        return Response(content=body, media_type="application/json")
+        
+    except Exception as e:
+        logger.error(f"Error answering question: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Streaming question answering endpoint
+@app.post("/ask/stream")
+async def ask_question_stream(request: QuestionRequest):
+    """
+    Answer a question as newline-delimited JSON, streamed while the answer is generated:
+    {"delta": ...} lines carry the answer text, and a final line carries confidence and sources
+    """
+    try:
+        processed_data = await asyncio.to_thread(data_processor.load_processed_data, "processed_data_latest.json")
+        
+        if not processed_data:
+            events = _single_answer_events(
+                "I don't have access to the Lexicanum data yet. Please run the scraping process first to populate the knowledge base.",
+                0.1
+            )
+        else:
+            context = await asyncio.to_thread(llm_service.find_relevant_context, request.question, processed_data)
+            if context:
+                events = llm_service.astream_answer(request.question, context)
+            else:
+                events = _single_answer_events(
+                    "I couldn't find relevant information in the knowledge base to answer your question. The knowledge base might need to be updated with more data.",
+                    0.2
+                )
+        
+        return StreamingResponse(_ndjson_stream(events), media_type="application/x-ndjson")
         
     except Exception as e:
         logger.error(f"Error answering question: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _single_answer_events(answer: str, confidence: float) -> AsyncIterator[Dict]:
+    """A canned answer in the same event format as LLMService.astream_answer"""
+    yield {"delta": answer}
+    yield {"confidence": confidence, "sources": ["https://wh40k.lexicanum.com/wiki/Main_Page"]}
+
+async def _ndjson_stream(events: AsyncIterator[Dict]) -> AsyncIterator[bytes]:
+    async for event in events:
+        yield orjson.dumps(event, option=orjson.OPT_APPEND_NEWLINE)
+
 # Data scraping endpoint
 @app.post("/scrape")
 async def scrape_lexicanum(request: ScrapeRequest):
@@ -126,16 +198,16 @@ async def scrape_lexicanum(request: ScrapeRequest):
         logger.info(f"Starting scrape of {request.url}")
         
         # Scrape the specified URL
-        scraped_data = scraper.scrape_page(request.url)
+        scraped_data = await asyncio.to_thread(scraper.scrape_page, request.url)
         
         if not scraped_data:
             raise HTTPException(status_code=400, detail="Failed to scrape the specified URL")
         
         # Process the scraped data
-        processed_data = data_processor.process_batch([scraped_data])
+        processed_data = await asyncio.to_thread(data_processor.process_batch, [scraped_data])
         
-        # Save processed data
-        filename = data_processor.save_processed_data(processed_data, "processed_data_latest.json")
+        # Buffer processed data; it is written once enough entries accumulate
+        filename = await asyncio.to_thread(processed_store.add, processed_data)
         
         # Get statistics
         stats = data_processor.get_processing_statistics(processed_data)
@@ -144,6 +216,7 @@ async def scrape_lexicanum(request: ScrapeRequest):
             "message": "Scraping completed successfully",
             "url": request.url,
             "filename": filename,
+            "buffered_entries": len(processed_store.buffer),
             "total_entries": stats["total_entries"],
             "categories": list(stats["category_distribution"].keys())
         }
@@ -152,23 +225,60 @@ async def scrape_lexicanum(request: ScrapeRequest):
         logger.error(f"Error scraping {request.url}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Flush buffered scrape results endpoint
+@app.post("/flush")
+def flush_scraped_data():
+    """
+    Write any buffered scrape results to the knowledge base
+    """
+    try:
+        flushed = len(processed_store.buffer)
+        filename = processed_store.flush()
+        
+        return {
+            "message": "Buffered data flushed" if filename else "No buffered data to flush",
+            "filename": filename,
+            "flushed_entries": flushed if filename else 0
+        }
+        
+    except Exception as e:
+        logger.error(f"Error flushing buffered data: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.on_event("shutdown")
+def flush_on_shutdown():
+    processed_store.flush()
+    llm_service.save_semantic_cache()
+
+def _latest_scraped_file(data_dir: str) -> Optional[str]:
+    """Name of the newest lexicanum_data_*.json file, using each DirEntry's cached stat"""
+    try:
+        with os.scandir(data_dir) as entries:
+            latest = max(
+                (entry for entry in entries
+                 if entry.name.startswith("lexicanum_data_") and entry.name.endswith(".json")),
+                key=lambda entry: entry.stat().st_ctime,
+                default=None
+            )
+    except FileNotFoundError:
+        return None
+    return latest.name if latest else None
+
 # Process existing data endpoint
 @app.post("/process-data")
-async def process_existing_data():
+def process_existing_data():
     """
     Process any existing scraped data
     """
     try:
-        # Look for existing scraped data files
-        import glob
-        data_files = glob.glob("data/lexicanum_data_*.json")
+        # Find the most recent scraped data file in a single directory pass
+        latest_file = _latest_scraped_file(scraper.data_dir)
         
-        if not data_files:
+        if latest_file is None:
             return {"message": "No scraped data files found. Please run scraping first."}
         
         # Load the most recent file
-        latest_file = max(data_files, key=os.path.getctime)
-        raw_data = scraper.load_data(os.path.basename(latest_file))
+        raw_data = scraper.load_data(latest_file)
         
         # Process the data
         processed_data = data_processor.process_batch(raw_data)
@@ -193,7 +303,7 @@ async def process_existing_data():
 
 # Search endpoint
 @app.post("/search")
-async def search_knowledge_base(request: SearchRequest):
+def search_knowledge_base(request: SearchRequest):
     """
     Search through the knowledge base
     """
@@ -204,32 +314,56 @@ async def search_knowledge_base(request: SearchRequest):
         if not processed_data:
             return {"message": "No processed data available", "results": []}
         
-        # Search through the data
-        results = data_processor.search_content(processed_data, request.query)
+        cache_key = response_cache.make_key(
+            "search", request.query, data_processor.data_version("processed_data_latest.json"), request.limit
+        )
+        cached = response_cache.get(cache_key)
+        if cached:
+            return Response(content=cached, media_type="application/json")
         
-        # Limit results
-        limited_results = results[:request.limit]
+        # Search through the data
+        total_results, results = data_processor.search_content(processed_data, request.query, request.limit)
         
-        return {
-            "query": request.query,
-            "total_results": len(results),
-            "returned_results": len(limited_results),
-            "results": [
-                {
-                    "title": result["entry"]["title"],
-                    "url": result["entry"]["url"],
-                    "score": result["score"],
-                    "matched_fields": result["matched_fields"],
-                    "preview": result["entry"]["content"][:200] + "..."
-                }
-                for result in limited_results
-            ]
-        }
+        return StreamingResponse(
+            _cache_stream(cache_key, _stream_search_results(request.query, total_results, results)),
+            media_type="application/json"
+        )
         
     except Exception as e:
         logger.error(f"Error searching: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _stream_search_results(query: str, total_results: int, results: List[Dict]) -> Iterator[bytes]:
+    """Serialize search results one at a time instead of building the whole response body"""
+    header = orjson.dumps({
+        "query": query,
+        "total_results": total_results,
+        "returned_results": len(results)
+    })
+    # Reopen the header object so the results array can be appended to it
+    yield header[:-1] + b',"results":['
+    
+    for i, result in enumerate(results):
+        entry = result["entry"]
+        item = orjson.dumps({
+            "title": entry["title"],
+            "url": entry["url"],
+            "score": result["score"],
+            "matched_fields": result["matched_fields"],
+            "preview": entry.get("_preview") or entry["content"][:200] + "..."
+        })
+        yield item if i == 0 else b"," + item
+    
+    yield b"]}"
+
+def _cache_stream(cache_key: bytes, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """Pass chunks through to the client and cache the full body once it has been sent"""
+    body = []
+    for chunk in chunks:
+        body.append(chunk)
+        yield chunk
+    response_cache.set(cache_key, b"".join(body))
+
 # Get available topics
 @app.get("/topics")
 async def get_topics():
@@ -1,13 +1,30 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float
+from sqlalchemy import create_engine, event, insert, Column, Index, Integer, String, Text, DateTime, Float
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
 from datetime import datetime
+from typing import List, Dict
 import os
 
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./wh40k_lore.db")
 
-engine = create_engine(DATABASE_URL)
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+engine = create_engine(
+    DATABASE_URL,
+    pool_pre_ping=True,
+    connect_args={"check_same_thread": False} if IS_SQLITE else {}
+)
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers proceed during writes; NORMAL sync is safe under WAL
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -24,6 +41,10 @@ class LoreEntry(Base):
     tags = Column(Text)  # JSON string of tags
     scraped_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('ix_lore_entries_category_title', 'category', 'title'),
+    )
 
 class Question(Base):
     """Database model for user questions"""
@@ -50,6 +71,15 @@ class Category(Base):
 def create_tables():
     Base.metadata.create_all(bind=engine)
 
+def bulk_insert_entries(db: Session, entries: List[Dict]) -> int:
+    """Insert many lore entries in a single executemany instead of one ORM add per row"""
+    if not entries:
+        return 0
+    
+    db.execute(insert(LoreEntry), entries)
+    db.commit()
+    return len(entries)
+
 # Database dependency
 def get_db():
     db = SessionLocal()
@@ -1,32 +1,90 @@
+import asyncio
+import functools
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 import time
 import logging
-from typing import List, Dict, Set, Optional
+from typing import AsyncIterator, List, Dict, Set, Optional, Tuple
 from urllib.parse import urljoin, urlparse
 import re
-import json
-from datetime import datetime
+import orjson
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import os
 
 logger = logging.getLogger(__name__)
 
+_WORD_RE = re.compile(r'\S+')
+
+# Retries for throttled and failed requests, shared by the sync session and the async client
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+def _retry_after_seconds(response: httpx.Response) -> Optional[float]:
+    """Delay asked for by a Retry-After header, given either in seconds or as an HTTP date"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+@functools.lru_cache(maxsize=8192)
+def _absolute_url(base_url: str, href: str) -> str:
+    """urljoin memoized for hrefs that repeat across pages"""
+    return urljoin(base_url, href)
+
 class LexicanumScraper:
     """
     Web scraper for Warhammer 40K Lexicanum wiki
     """
     
-    def __init__(self, base_url: str = "https://wh40k.lexicanum.com", delay: float = 1.0, data_dir: str = "data"):
+    def __init__(self, base_url: str = "https://wh40k.lexicanum.com", delay: float = 1.0, data_dir: str = "data",
+                 concurrency: int = 8):
         self.base_url = base_url
         self.delay = delay
         self.data_dir = data_dir
+        self.concurrency = concurrency
+        self.headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Accept-Encoding': 'gzip, deflate'
+        }
         self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+        self.session.headers.update(self.headers)
+        
+        # Pooled keep-alive connections with backoff on throttling and server errors
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=64,
+            max_retries=Retry(
+                total=MAX_RETRIES,
+                backoff_factor=RETRY_BACKOFF,
+                status_forcelist=sorted(RETRY_STATUSES)
+            )
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self.visited_urls: Set[str] = set()
         self.scraped_data: List[Dict] = []
         
+        # Per-host rate limit for the async methods: the earliest time (time.monotonic) each
+        # host may receive its next request, and locks so concurrent tasks take turns
+        self._host_next_request: Dict[str, float] = {}
+        self._host_locks: Dict[str, asyncio.Lock] = {}
+        self._host_locks_loop: Optional[asyncio.AbstractEventLoop] = None
+        
         # Create data directory if it doesn't exist
         os.makedirs(self.data_dir, exist_ok=True)
         
@@ -42,21 +100,7 @@ class LexicanumScraper:
             response = self.session.get(url, timeout=10)
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Extract page data
-            page_data = {
-                'url': url,
-                'title': self._extract_title(soup),
-                'content': self._extract_content(soup),
-                'categories': self._extract_categories(soup),
-                'links': self._extract_internal_links(soup),
-                'images': self._extract_images(soup),
-                'scraped_at': datetime.now().isoformat(),
-                'word_count': len(self._extract_content(soup).split()),
-                'has_infobox': self._extract_infobox(soup) is not None,
-                'infobox_data': self._extract_infobox(soup)
-            }
+            page_data = self._parse_page(url, response.content)
             
             self.visited_urls.add(url)
             time.sleep(self.delay)  # Be respectful to the server
@@ -67,6 +111,110 @@ class LexicanumScraper:
             logger.error(f"Error scraping {url}: {str(e)}")
             return None
     
+    async def scrape_page_async(self, client: httpx.AsyncClient, url: str,
+                                semaphore: Optional[asyncio.Semaphore] = None) -> Dict:
+        """
+        Scrape a single page from Lexicanum without blocking the event loop
+        """
+        semaphore = semaphore or asyncio.Semaphore(1)
+        try:
+            if url in self.visited_urls:
+                return None
+            # Claim the URL up front so concurrent tasks don't fetch it twice
+            self.visited_urls.add(url)
+            
+            async with semaphore:
+                logger.info(f"Scraping: {url}")
+                response = await self._get(client, url)
+            
+            # Parsing is CPU-bound, keep it off the event loop
+            return await asyncio.to_thread(self._parse_page, url, response.content)
+            
+        except Exception as e:
+            self.visited_urls.discard(url)
+            logger.error(f"Error scraping {url}: {str(e)}")
+            return None
+    
+    async def _get(self, client: httpx.AsyncClient, url: str) -> httpx.Response:
+        """
+        GET a URL, retrying throttled and failed requests with the same backoff as the
+        session's Retry adapter; a Retry-After header on the response takes precedence.
+        Every attempt waits its turn with the host, so each host gets at most one request
+        per `delay` seconds however many tasks are fetching from it
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            await self._wait_for_host(url)
+            try:
+                response = await client.get(url)
+            except httpx.TransportError:
+                if attempt == MAX_RETRIES:
+                    raise
+                backoff = RETRY_BACKOFF * 2 ** attempt
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    response.raise_for_status()
+                    return response
+                retry_after = _retry_after_seconds(response)
+                backoff = RETRY_BACKOFF * 2 ** attempt if retry_after is None else retry_after
+            
+            logger.warning(f"Retrying {url} in {backoff:.1f}s (retry {attempt + 1} of {MAX_RETRIES})")
+            # Back off the whole host, not just this request
+            self._defer_host(url, backoff)
+    
+    async def _wait_for_host(self, url: str) -> None:
+        """Wait until the URL's host may be sent a request, then reserve the next `delay` seconds"""
+        host = urlparse(url).netloc
+        async with self._host_lock(host):
+            wait = self._host_next_request.get(host, 0.0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._host_next_request[host] = time.monotonic() + self.delay
+    
+    def _defer_host(self, url: str, seconds: float) -> None:
+        """Hold off every request to the URL's host for at least `seconds`"""
+        host = urlparse(url).netloc
+        self._host_next_request[host] = max(self._host_next_request.get(host, 0.0), time.monotonic() + seconds)
+    
+    def _host_lock(self, host: str) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._host_locks_loop is not loop:
+            # Locks are bound to one event loop; start afresh when used from another
+            self._host_locks_loop = loop
+            self._host_locks = {}
+        if host not in self._host_locks:
+            self._host_locks[host] = asyncio.Lock()
+        return self._host_locks[host]
+    
+    def _async_client(self) -> httpx.AsyncClient:
+        """Build an async HTTP client sized for the configured concurrency"""
+        return httpx.AsyncClient(
+            headers=self.headers,
+            timeout=10,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=self.concurrency)
+        )
+    
+    def _parse_page(self, url: str, html: bytes) -> Dict:
+        """Extract page data from raw HTML"""
+        soup = BeautifulSoup(html, 'lxml')
+        
+        # Each extractor walks the tree, so run them once
+        content = self._extract_content(soup)
+        infobox = self._extract_infobox(soup)
+        
+        return {
+            'url': url,
+            'title': self._extract_title(soup),
+            'content': content,
+            'categories': self._extract_categories(soup),
+            'links': self._extract_internal_links(soup),
+            'images': self._extract_images(soup),
+            'scraped_at': datetime.now().isoformat(),
+            'word_count': sum(1 for _ in _WORD_RE.finditer(content)),
+            'has_infobox': infobox is not None,
+            'infobox_data': infobox
+        }
+    
     def _extract_title(self, soup: BeautifulSoup) -> str:
         """Extract page title"""
         title_elem = soup.find('h1', {'class': 'firstHeading'})
@@ -100,13 +248,13 @@ class LexicanumScraper:
     
     def _extract_internal_links(self, soup: BeautifulSoup) -> List[str]:
         """Extract internal links to other Lexicanum pages"""
-        links = []
+        links = set()
         for link in soup.find_all('a', href=True):
             href = link['href']
-            if href.startswith('/wiki/') and ':' not in href:
-                full_url = urljoin(self.base_url, href)
-                links.append(full_url)
-        return list(set(links))  # Remove duplicates
+            # Skip non-article namespaces such as File:, Special: and Help:
+            if href.startswith('/wiki/') and ':' not in href[6:]:
+                links.add(_absolute_url(self.base_url, href))
+        return list(links)
     
     def _extract_images(self, soup: BeautifulSoup) -> List[str]:
         """Extract image URLs from the page"""
@@ -145,8 +293,8 @@ class LexicanumScraper:
         
         filepath = os.path.join(self.data_dir, filename)
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(self.scraped_data, f, indent=2, ensure_ascii=False)
+        with open(filepath, 'wb') as f:
+            f.write(orjson.dumps(self.scraped_data, option=orjson.OPT_INDENT_2))
         
         logger.info(f"Saved {len(self.scraped_data)} entries to {filepath}")
         return filepath
@@ -159,8 +307,8 @@ class LexicanumScraper:
             logger.warning(f"File {filepath} does not exist")
             return []
         
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(filepath, 'rb') as f:
+            data = orjson.loads(f.read())
         
         logger.info(f"Loaded {len(data)} entries from {filepath}")
         return data
@@ -184,15 +332,45 @@ class LexicanumScraper:
             "avg_words_per_entry": total_words / total_entries if total_entries > 0 else 0
         }
     
-    def scrape_category(self, category_url: str, max_pages: int = 50) -> List[Dict]:
+    async def scrape_pages(self, urls: List[str]) -> List[Optional[Dict]]:
         """
-        Scrape all pages in a category
+        Scrape several pages concurrently, at most `concurrency` in flight.
+        Results line up with `urls`; pages that failed are None.
         """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._async_client() as client:
+            return await asyncio.gather(*[self.scrape_page_async(client, url, semaphore) for url in urls])
+    
+    async def iter_scraped_pages(self, urls: List[str]) -> AsyncIterator[Tuple[str, Optional[Dict]]]:
+        """
+        Scrape several pages concurrently, yielding (url, page_data) as each one finishes
+        so callers can start processing before the whole batch is fetched
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async with self._async_client() as client:
+            async def scrape(url: str) -> Tuple[str, Optional[Dict]]:
+                return url, await self.scrape_page_async(client, url, semaphore)
+            
+            for next_done in asyncio.as_completed([scrape(url) for url in urls]):
+                yield await next_done
+    
+    async def scrape_category(self, category_url: str, max_pages: int = 50,
+                              client: Optional[httpx.AsyncClient] = None,
+                              semaphore: Optional[asyncio.Semaphore] = None) -> List[Dict]:
+        """
+        Scrape all pages in a category, fetching up to `concurrency` pages at once
+        """
+        if client is None:
+            async with self._async_client() as client:
+                return await self.scrape_category(category_url, max_pages, client, semaphore)
+        
+        semaphore = semaphore or asyncio.Semaphore(self.concurrency)
         try:
-            response = self.session.get(category_url, timeout=10)
-            response.raise_for_status()
+            async with semaphore:
+                response = await self._get(client, category_url)
             
-            soup = BeautifulSoup(response.content, 'html.parser')
+            soup = BeautifulSoup(response.content, 'lxml')
             
             # Find all page links in the category
             page_links = []
@@ -203,24 +381,20 @@ class LexicanumScraper:
                     page_links.append(full_url)
             
             # Scrape pages (limit to max_pages)
-            scraped_pages = []
-            for i, page_url in enumerate(page_links[:max_pages]):
-                if i >= max_pages:
-                    break
-                    
-                page_data = self.scrape_page(page_url)
-                if page_data:
-                    scraped_pages.append(page_data)
-                    
-                logger.info(f"Progress: {i+1}/{min(len(page_links), max_pages)}")
+            page_links = page_links[:max_pages]
+            results = await asyncio.gather(
+                *[self.scrape_page_async(client, page_url, semaphore) for page_url in page_links]
+            )
+            scraped_pages = [page_data for page_data in results if page_data]
             
+            logger.info(f"Scraped {len(scraped_pages)}/{len(page_links)} pages from {category_url}")
             return scraped_pages
             
         except Exception as e:
             logger.error(f"Error scraping category {category_url}: {str(e)}")
             return []
     
-    def scrape_main_categories(self, max_pages_per_category: int = 20) -> Dict[str, List[Dict]]:
+    async def scrape_main_categories(self, max_pages_per_category: int = 20) -> Dict[str, List[Dict]]:
         """
         Scrape main Warhammer 40K categories
         """
@@ -235,15 +409,17 @@ class LexicanumScraper:
             'Inquisition': '/wiki/Category:Inquisition'
         }
         
-        all_data = {}
+        # One client and one semaphore so the concurrency cap holds across categories
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._async_client() as client:
+            logger.info(f"Scraping categories: {', '.join(main_categories)}")
+            results = await asyncio.gather(*[
+                self.scrape_category(urljoin(self.base_url, category_path), max_pages_per_category,
+                                     client, semaphore)
+                for category_path in main_categories.values()
+            ])
         
-        for category_name, category_path in main_categories.items():
-            logger.info(f"Scraping category: {category_name}")
-            category_url = urljoin(self.base_url, category_path)
-            category_data = self.scrape_category(category_url, max_pages_per_category)
-            all_data[category_name] = category_data
-            
-        return all_data
+        return dict(zip(main_categories.keys(), results))
 
 # Example usage
 if __name__ == "__main__":
@@ -254,5 +430,5 @@ if __name__ == "__main__":
     print(f"Scraped page: {page_data['title'] if page_data else 'Failed'}")
     
     # Scrape main categories
-    # all_data = scraper.scrape_main_categories(max_pages_per_category=5)
+    # all_data = asyncio.run(scraper.scrape_main_categories(max_pages_per_category=5))
     # print(f"Scraped {len(all_data)} categories")
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Generic, List, Optional, Set, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+class AsyncBatcher(Generic[T, R]):
+    """
+    Groups requests submitted concurrently and dispatches them together.
+    A batch is sent once `max_batch` items are queued or `batch_timeout` seconds
+    after its first item arrived; its items are handled concurrently with asyncio.gather.
+    """
+    
+    def __init__(self, handler: Callable[[T], Awaitable[R]], max_batch: int = 16,
+                 batch_timeout: float = 0.02):
+        self.handler = handler
+        self.max_batch = max_batch
+        self.batch_timeout = batch_timeout
+        self._pending: Deque[Tuple[T, asyncio.Future]] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Dispatched batches, referenced until done so they aren't garbage collected
+        self._dispatches: Set[asyncio.Task] = set()
+    
+    async def submit(self, item: T) -> R:
+        """Queue an item for the next batch and wait for its result"""
+        loop = asyncio.get_running_loop()
+        if self._collector is None or self._collector.done() or self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._collector = loop.create_task(self._collect())
+        
+        future = loop.create_future()
+        self._pending.append((item, future))
+        self._wakeup.set()
+        return await future
+    
+    async def _collect(self) -> None:
+        """Form batches from submitted items for as long as the event loop runs"""
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            
+            # Give the batch until the timeout to fill up
+            deadline = loop.time() + self.batch_timeout
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            
+            batch = [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+            # Skip items whose callers were cancelled while queued
+            batch = [(item, future) for item, future in batch if not future.done()]
+            # Dispatch without waiting, so the next batch forms while this one is answered
+            task = loop.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+    
+    async def _dispatch(self, batch: List[Tuple[T, asyncio.Future]]) -> None:
+        logger.debug(f"Dispatching batch of {len(batch)} requests")
+        results = await asyncio.gather(*(self.handler(item) for item, _ in batch), return_exceptions=True)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                # The caller stopped waiting
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -1,12 +1,145 @@
-import json
+import orjson
 import re
-from typing import List, Dict, Optional, Tuple
+import math
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import Callable, List, Dict, Optional, Tuple
 import logging
 from datetime import datetime
 import os
+import tempfile
+import threading
+from collections import Counter
+from itertools import chain
 
 logger = logging.getLogger(__name__)
 
+_TOKEN_RE = re.compile(r'\w+')
+_WHITESPACE_RE = re.compile(r'\s+')
+# Common wiki artifacts: [edit], [citation needed] and references like [1], [2]
+_WIKI_ARTIFACTS_RE = re.compile(r'\[(?:edit|citation\s+needed|\d+)\]')
+
+# Common Warhammer 40K terms to look for
+KEY_TERMS = [
+    'Space Marine', 'Chaos', 'Eldar', 'Ork', 'Tau', 'Imperial Guard',
+    'Adeptus Astartes', 'Adeptus Mechanicus', 'Inquisition', 'Emperor',
+    'Horus Heresy', 'Primarch', 'Chapter', 'Legion', 'Warp', 'Psyker',
+    'Bolter', 'Chainsword', 'Power Armour', 'Terminator', 'Dreadnought',
+    'Titan', 'Knight', 'Baneblade', 'Leman Russ', 'Rhino', 'Land Raider'
+]
+
+# Zero-width lookahead so overlapping terms (e.g. 'Ork' and 'Knight' in 'warriorknight')
+# are all reported from a single scan of the lowercased content. Only the longest term
+# starting at each position is reported, so each term maps to itself and its term prefixes
+_KEY_TERMS_RE = re.compile(
+    '(?=(' + '|'.join(re.escape(term.lower()) for term in sorted(KEY_TERMS, key=len, reverse=True)) + '))'
+)
+_KEY_TERM_PREFIXES = {
+    term.lower(): {prefix.lower() for prefix in KEY_TERMS if term.lower().startswith(prefix.lower())}
+    for term in KEY_TERMS
+}
+
+# Priority order for categorization
+CATEGORY_KEYWORDS = {
+    'Space Marines': ['space marine', 'adeptus astartes', 'chapter', 'primarch'],
+    'Chaos': ['chaos', 'daemon', 'warp', 'heretic', 'chaos space marine'],
+    'Eldar': ['eldar', 'aeldari', 'craftworld', 'aspect warrior'],
+    'Orks': ['ork', 'orkz', 'warboss', 'gretchin', 'squig'],
+    'Tau': ['tau', 'tau empire', 'fire caste', 'ethereal'],
+    'Imperial Guard': ['imperial guard', 'astra militarum', 'regiment', 'commissar'],
+    'Adeptus Mechanicus': ['adeptus mechanicus', 'tech-priest', 'machine spirit', 'forge world'],
+    'Inquisition': ['inquisition', 'inquisitor', 'grey knight', 'daemonhunter']
+}
+
+# keyword -> (priority, main category)
+_KEYWORD_CATEGORY = {
+    keyword: (priority, main_cat)
+    for priority, (main_cat, keywords) in enumerate(CATEGORY_KEYWORDS.items())
+    for keyword in keywords
+}
+
+# The scan below reports only the longest keyword starting at each position; every other
+# keyword matching there is a prefix of it (e.g. 'daemon' of 'daemonhunter'), so each
+# keyword maps to the highest-priority category among itself and its keyword prefixes
+_CATEGORY_BY_KEYWORD = {
+    keyword: min(_KEYWORD_CATEGORY[prefix] for prefix in _KEYWORD_CATEGORY if keyword.startswith(prefix))
+    for keyword in _KEYWORD_CATEGORY
+}
+
+# Zero-width lookahead so overlapping keywords (e.g. 'chaos space marine' and
+# 'space marine') are all reported from a single scan
+_CATEGORY_KEYWORDS_RE = re.compile(
+    '(?=(' + '|'.join(re.escape(keyword) for keyword in sorted(_CATEGORY_BY_KEYWORD, key=len, reverse=True)) + '))'
+)
+
+# Lowercased copies kept on each processed entry in memory so searches never re-lowercase
+LOWERCASE_FIELDS = {
+    'title': '_title_lc',
+    'content': '_content_lc',
+    'main_category': '_cat_lc',
+    'key_terms': '_terms_lc'
+}
+
+# Fields derived from an entry when it is processed or loaded; they are not written to disk
+DERIVED_FIELDS = frozenset(LOWERCASE_FIELDS.values()) | {'_preview'}
+
+# Nested dict columns stored as JSON strings in Parquet so rows keep their own keys
+_PARQUET_JSON_COLUMNS = ('infobox_data',)
+
+# A term's posting list: aligned arrays of doc ids and weighted term frequencies
+Postings = Tuple[np.ndarray, np.ndarray]
+
+# Term-frequency weight given to each field when indexing an entry
+INDEX_FIELD_WEIGHTS = {
+    'title': 3,
+    'key_terms': 2,
+    'main_category': 2,
+    'content': 1
+}
+
+def _score_postings(doc_id_arrays: List[np.ndarray], weight_arrays: List[np.ndarray], n_docs: int) -> np.ndarray:
+    """Sum per-document tf-idf weights over the query's posting lists"""
+    if not doc_id_arrays:
+        return np.zeros(n_docs)
+    return np.bincount(
+        np.concatenate(doc_id_arrays),
+        weights=np.concatenate(weight_arrays),
+        minlength=n_docs
+    )
+
+def _best_category_match(*texts: str) -> Optional[str]:
+    """Highest-priority main category whose keywords occur in any of the lowercase texts"""
+    best = None
+    for text in texts:
+        for match in _CATEGORY_KEYWORDS_RE.finditer(text):
+            priority, main_cat = _CATEGORY_BY_KEYWORD[match.group(1)]
+            if best is None or priority < best[0]:
+                if priority == 0:
+                    return main_cat
+                best = (priority, main_cat)
+    return best[1] if best else None
+
+def _add_derived_fields(entry: Dict) -> Dict:
+    """Add the lowercased search fields and the search result preview to an entry"""
+    entry['_title_lc'] = (entry.get('title') or '').lower()
+    entry['_content_lc'] = (entry.get('content') or '').lower()
+    entry['_cat_lc'] = (entry.get('main_category') or '').lower()
+    entry['_terms_lc'] = [term.lower() for term in entry.get('key_terms') or []]
+    entry['_preview'] = (entry.get('content') or '')[:200] + '...'
+    return entry
+
+def _without_derived_fields(entry: Dict) -> Dict:
+    return {key: value for key, value in entry.items() if key not in DERIVED_FIELDS}
+
+def _lowercase_field(entry: Dict, field: str):
+    """Return the precomputed lowercase copy of a field, lowercasing on the fly for older data"""
+    value = entry.get(LOWERCASE_FIELDS[field])
+    if value is not None:
+        return value
+    value = entry.get(field) or ''
+    return [item.lower() for item in value] if isinstance(value, list) else value.lower()
+
 class DataProcessor:
     """
     Process and clean scraped Lexicanum data
@@ -15,86 +148,53 @@ class DataProcessor:
     def __init__(self, data_dir: str = "data"):
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
+        
+        # Parsed processed-data files keyed by path, stored with their mtime
+        self._cache: Dict[str, Tuple[float, List[Dict]]] = {}
+        
+        # Inverted index over one entry list: (entries, term -> (doc_ids, tfs), term -> idf).
+        # Swapped in as a single tuple so concurrent searches never see a mixed state.
+        self._index: Tuple[Optional[List[Dict]], Dict[str, Postings], Dict[str, float]] = (None, {}, {})
     
     def clean_text(self, text: str) -> str:
         """Clean and normalize text content"""
         if not text:
             return ""
         
-        # Remove extra whitespace and newlines
-        text = re.sub(r'\s+', ' ', text)
-        
-        # Remove common wiki artifacts
-        text = re.sub(r'\[edit\]', '', text)
-        text = re.sub(r'\[citation needed\]', '', text)
-        text = re.sub(r'\[1\]|\[2\]|\[3\]|\[4\]|\[5\]', '', text)
-        
-        # Remove references like [1], [2], etc.
-        text = re.sub(r'\[\d+\]', '', text)
-        
-        # Clean up multiple spaces
-        text = re.sub(r' +', ' ', text)
+        # Remove wiki artifacts, then collapse whitespace and newlines
+        text = _WIKI_ARTIFACTS_RE.sub('', text)
+        text = _WHITESPACE_RE.sub(' ', text)
         
         return text.strip()
     
     def extract_key_terms(self, content: str) -> List[str]:
         """Extract key terms and concepts from content"""
-        # Common Warhammer 40K terms to look for
-        key_terms = [
-            'Space Marine', 'Chaos', 'Eldar', 'Ork', 'Tau', 'Imperial Guard',
-            'Adeptus Astartes', 'Adeptus Mechanicus', 'Inquisition', 'Emperor',
-            'Horus Heresy', 'Primarch', 'Chapter', 'Legion', 'Warp', 'Psyker',
-            'Bolter', 'Chainsword', 'Power Armour', 'Terminator', 'Dreadnought',
-            'Titan', 'Knight', 'Baneblade', 'Leman Russ', 'Rhino', 'Land Raider'
-        ]
-        
-        found_terms = []
-        content_lower = content.lower()
-        
-        for term in key_terms:
-            if term.lower() in content_lower:
-                found_terms.append(term)
-        
-        return found_terms
+        # Single pass over the content; report terms in KEY_TERMS order
+        found = set().union(*(_KEY_TERM_PREFIXES[match] for match in _KEY_TERMS_RE.findall(content.lower())))
+        return [term for term in KEY_TERMS if term.lower() in found]
     
     def categorize_content(self, title: str, content: str, categories: List[str]) -> str:
         """Determine the main category for content"""
-        # Priority order for categorization
-        category_keywords = {
-            'Space Marines': ['space marine', 'adeptus astartes', 'chapter', 'primarch'],
-            'Chaos': ['chaos', 'daemon', 'warp', 'heretic', 'chaos space marine'],
-            'Eldar': ['eldar', 'aeldari', 'craftworld', 'aspect warrior'],
-            'Orks': ['ork', 'orkz', 'warboss', 'gretchin', 'squig'],
-            'Tau': ['tau', 'tau empire', 'fire caste', 'ethereal'],
-            'Imperial Guard': ['imperial guard', 'astra militarum', 'regiment', 'commissar'],
-            'Adeptus Mechanicus': ['adeptus mechanicus', 'tech-priest', 'machine spirit', 'forge world'],
-            'Inquisition': ['inquisition', 'inquisitor', 'grey knight', 'daemonhunter']
-        }
-        
         # Check categories first
         for cat in categories:
-            for main_cat, keywords in category_keywords.items():
-                if any(keyword in cat.lower() for keyword in keywords):
-                    return main_cat
-        
-        # Check content for keywords
-        content_lower = content.lower()
-        title_lower = title.lower()
-        
-        for main_cat, keywords in category_keywords.items():
-            for keyword in keywords:
-                if keyword in content_lower or keyword in title_lower:
-                    return main_cat
+            main_cat = _best_category_match(cat.lower())
+            if main_cat:
+                return main_cat
         
-        return 'General'
+        # Check title and content for keywords
+        return _best_category_match(title.lower(), content.lower()) or 'General'
     
     def process_entry(self, entry: Dict) -> Dict:
         """Process a single scraped entry"""
-        processed = entry.copy()
-        
-        # Clean content
-        processed['content'] = self.clean_text(entry.get('content', ''))
-        processed['title'] = self.clean_text(entry.get('title', ''))
+        # Keep only the fields used downstream; links and images stay in the raw scrape file
+        processed = {
+            'url': entry.get('url'),
+            'title': self.clean_text(entry.get('title', '')),
+            'content': self.clean_text(entry.get('content', '')),
+            'categories': entry.get('categories', []),
+            'scraped_at': entry.get('scraped_at'),
+            'infobox_data': entry.get('infobox_data')
+        }
         
         # Extract key terms
         processed['key_terms'] = self.extract_key_terms(processed['content'])
@@ -111,7 +211,8 @@ class DataProcessor:
         processed['content_length'] = len(processed['content'])
         processed['has_infobox'] = bool(entry.get('infobox_data'))
         
-        return processed
+        # Lowercase and pre-render the preview once here rather than on every search
+        return _add_derived_fields(processed)
     
     def process_batch(self, entries: List[Dict]) -> List[Dict]:
         """Process a batch of entries"""
@@ -129,33 +230,184 @@ class DataProcessor:
         return processed_entries
     
     def save_processed_data(self, processed_entries: List[Dict], filename: str = None) -> str:
-        """Save processed data to JSON file"""
+        """Save processed data to a JSON file, or Parquet if the filename ends in .parquet"""
         if not filename:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"processed_data_{timestamp}.json"
         
         filepath = os.path.join(self.data_dir, filename)
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(processed_entries, f, indent=2, ensure_ascii=False)
+        # Derived fields are rebuilt on load, so only the entries' own fields are written
+        stored_entries = [_without_derived_fields(entry) for entry in processed_entries]
+        if self._is_parquet(filepath):
+            self._write_atomic(filepath, lambda path: self._write_parquet(path, stored_entries))
+        else:
+            self._write_atomic(filepath, lambda path: self._write_bytes(
+                path, orjson.dumps(stored_entries, option=orjson.OPT_INDENT_2)
+            ))
+        
+        # Keep the cache in step with what is now on disk
+        self._cache[filepath] = (os.stat(filepath).st_mtime, processed_entries)
+        
+        # Persist the search index next to the data so a reload doesn't rebuild it
+        self.build_index(processed_entries)
+        self._save_index(filepath)
         
         logger.info(f"Saved {len(processed_entries)} processed entries to {filepath}")
         return filepath
     
     def load_processed_data(self, filename: str) -> List[Dict]:
-        """Load processed data from JSON file"""
+        """Load processed data from JSON or Parquet, reusing the parsed copy while the file is unchanged"""
         filepath = os.path.join(self.data_dir, filename)
         
-        if not os.path.exists(filepath):
+        try:
+            mtime = os.stat(filepath).st_mtime
+        except FileNotFoundError:
             logger.warning(f"File {filepath} does not exist")
+            self._cache.pop(filepath, None)
             return []
         
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        cached = self._cache.get(filepath)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        
+        if self._is_parquet(filepath):
+            data = self._read_parquet(filepath)
+        else:
+            with open(filepath, 'rb') as f:
+                data = orjson.loads(f.read())
+        for entry in data:
+            _add_derived_fields(entry)
         
+        self._cache[filepath] = (mtime, data)
+        self._load_index(filepath, data, mtime)
         logger.info(f"Loaded {len(data)} processed entries from {filepath}")
         return data
     
+    def data_version(self, filename: str) -> Optional[float]:
+        """Modification time of a processed data file, used to version derived caches"""
+        try:
+            return os.stat(os.path.join(self.data_dir, filename)).st_mtime
+        except FileNotFoundError:
+            return None
+    
+    def load_processed_table(self, filename: str) -> Optional[pa.Table]:
+        """Memory-map a Parquet processed data file as an Arrow table for columnar access"""
+        filepath = os.path.join(self.data_dir, filename)
+        
+        if not os.path.exists(filepath):
+            logger.warning(f"File {filepath} does not exist")
+            return None
+        
+        return pq.read_table(filepath, memory_map=True)
+    
+    def _write_atomic(self, filepath: str, write: Callable[[str], None]) -> None:
+        """
+        Write a file through write(path) on a temporary file and swap it in, so readers never
+        see a partial file. Each write gets its own temporary file, so concurrent writers of
+        the same path don't truncate each other's output.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filepath) or '.', suffix='.tmp')
+        os.close(fd)
+        try:
+            # mkstemp creates the file private to the owner; keep the usual data file mode
+            os.chmod(tmp_path, 0o644)
+            write(tmp_path)
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    def _write_bytes(self, filepath: str, data: bytes) -> None:
+        with open(filepath, 'wb') as f:
+            f.write(data)
+    
+    def _is_parquet(self, filepath: str) -> bool:
+        return filepath.endswith('.parquet')
+    
+    def _write_parquet(self, filepath: str, processed_entries: List[Dict]) -> None:
+        """Write entries as a Parquet table"""
+        rows = [
+            {**entry, **{column: orjson.dumps(entry.get(column)).decode() for column in _PARQUET_JSON_COLUMNS}}
+            for entry in processed_entries
+        ]
+        # Columns from every row, since older and newer entry formats can be mixed; from_pylist
+        # would take them from the first row only. Rows without a column store null there
+        columns = dict.fromkeys(chain.from_iterable(rows))
+        pq.write_table(pa.Table.from_pydict({column: [row.get(column) for row in rows] for column in columns}), filepath)
+    
+    def _read_parquet(self, filepath: str) -> List[Dict]:
+        """Read entries back from a Parquet table"""
+        rows = pq.read_table(filepath, memory_map=True).to_pylist()
+        for row in rows:
+            for column in _PARQUET_JSON_COLUMNS:
+                if row.get(column) is not None:
+                    row[column] = orjson.loads(row[column])
+        return rows
+    
+    def _index_path(self, filepath: str) -> str:
+        """Path of the search index stored alongside a processed data file"""
+        return f"{os.path.splitext(filepath)[0]}_index.json"
+    
+    def _save_index(self, filepath: str) -> None:
+        """Write the current search index as term -> [doc_ids, tfs]"""
+        entries, index, _ = self._index
+        payload = {
+            'n_docs': len(entries),
+            'postings': {
+                term: [doc_ids.tolist(), tfs.tolist()]
+                for term, (doc_ids, tfs) in index.items()
+            }
+        }
+        self._write_atomic(self._index_path(filepath), lambda path: self._write_bytes(path, orjson.dumps(payload)))
+    
+    def _load_index(self, filepath: str, entries: List[Dict], data_mtime: float) -> None:
+        """Load a persisted search index for `entries` if it is at least as new as the data"""
+        index_path = self._index_path(filepath)
+        try:
+            if os.stat(index_path).st_mtime < data_mtime:
+                return
+            with open(index_path, 'rb') as f:
+                payload = orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return
+        
+        if payload.get('n_docs') != len(entries):
+            return
+        
+        index = {
+            term: (np.asarray(doc_ids, dtype=np.int32), np.asarray(tfs, dtype=np.int32))
+            for term, (doc_ids, tfs) in payload['postings'].items()
+        }
+        self._set_index(entries, index)
+    
+    def build_index(self, processed_entries: List[Dict]) -> None:
+        """Build an inverted index (term -> aligned doc_id / weighted tf arrays) over processed entries"""
+        counts: Dict[str, Dict[int, int]] = {}
+        
+        for doc_id, entry in enumerate(processed_entries):
+            for field, weight in INDEX_FIELD_WEIGHTS.items():
+                value = _lowercase_field(entry, field)
+                if isinstance(value, list):
+                    value = ' '.join(value)
+                for term in _TOKEN_RE.findall(value):
+                    postings = counts.setdefault(term, {})
+                    postings[doc_id] = postings.get(doc_id, 0) + weight
+        
+        index = {
+            term: (np.fromiter(postings.keys(), dtype=np.int32, count=len(postings)),
+                   np.fromiter(postings.values(), dtype=np.int32, count=len(postings)))
+            for term, postings in counts.items()
+        }
+        self._set_index(processed_entries, index)
+    
+    def _set_index(self, entries: List[Dict], index: Dict[str, Postings]) -> None:
+        """Install an index and precompute its idf table"""
+        n_docs = len(entries)
+        # Smoothed idf so terms present in every entry still contribute
+        idf = {term: math.log(1 + n_docs / len(doc_ids)) for term, (doc_ids, _) in index.items()}
+        self._index = (entries, index, idf)
+    
     def get_processing_statistics(self, processed_entries: List[Dict]) -> Dict:
         """Get statistics about processed data"""
         if not processed_entries:
@@ -165,80 +417,133 @@ class DataProcessor:
         total_content_length = sum(entry.get('content_length', 0) for entry in processed_entries)
         
         # Category distribution
-        categories = {}
-        for entry in processed_entries:
-            cat = entry.get('main_category', 'Unknown')
-            categories[cat] = categories.get(cat, 0) + 1
+        categories = Counter(entry.get('main_category', 'Unknown') for entry in processed_entries)
         
         # Key terms frequency
-        all_key_terms = []
-        for entry in processed_entries:
-            all_key_terms.extend(entry.get('key_terms', []))
-        
-        term_frequency = {}
-        for term in all_key_terms:
-            term_frequency[term] = term_frequency.get(term, 0) + 1
+        term_frequency = Counter(chain.from_iterable(entry.get('key_terms', ()) for entry in processed_entries))
         
         # Top terms
-        top_terms = sorted(term_frequency.items(), key=lambda x: x[1], reverse=True)[:10]
+        top_terms = term_frequency.most_common(10)
         
         return {
             "total_entries": total_entries,
             "total_content_length": total_content_length,
             "avg_content_length": total_content_length / total_entries if total_entries > 0 else 0,
-            "category_distribution": categories,
+            "category_distribution": dict(categories),
             "top_terms": top_terms,
             "entries_with_infobox": sum(1 for entry in processed_entries if entry.get('has_infobox', False))
         }
     
-    def search_content(self, processed_entries: List[Dict], query: str) -> List[Dict]:
-        """Search through processed entries"""
-        query_lower = query.lower()
-        results = []
-        
-        for entry in processed_entries:
-            score = 0
-            
-            # Title match (higher weight)
-            if query_lower in entry.get('title', '').lower():
-                score += 10
-            
-            # Content match
-            if query_lower in entry.get('content', '').lower():
-                score += 5
-            
-            # Key terms match
-            for term in entry.get('key_terms', []):
-                if query_lower in term.lower():
-                    score += 3
-            
-            # Category match
-            if query_lower in entry.get('main_category', '').lower():
-                score += 2
-            
-            if score > 0:
-                results.append({
-                    'entry': entry,
-                    'score': score,
-                    'matched_fields': self._get_matched_fields(entry, query_lower)
-                })
-        
-        # Sort by score (highest first)
-        results.sort(key=lambda x: x['score'], reverse=True)
-        return results
+    def search_content(self, processed_entries: List[Dict], query: str,
+                       limit: Optional[int] = None) -> Tuple[int, List[Dict]]:
+        """
+        Search through processed entries, ranking matches by tf-idf.
+        Returns the number of matching entries and the top `limit` of them (all if None).
+        """
+        entries, index, idf = self._index
+        if entries is not processed_entries:
+            self.build_index(processed_entries)
+            entries, index, idf = self._index
+        
+        query_terms = set(_TOKEN_RE.findall(query.lower()))
+        matched_terms = [term for term in query_terms if term in index]
+        
+        scores = _score_postings(
+            [index[term][0] for term in matched_terms],
+            [index[term][1] * idf[term] for term in matched_terms],
+            len(entries)
+        )
+        
+        # Sort by score (highest first), partitioning out the top `limit` first
+        doc_ids = np.flatnonzero(scores)
+        total = len(doc_ids)
+        if limit is not None and limit < total:
+            top = np.argpartition(-scores[doc_ids], max(limit - 1, 0))[:limit]
+            doc_ids = doc_ids[top]
+        doc_ids = doc_ids[np.argsort(-scores[doc_ids], kind='stable')]
+        
+        return total, [
+            {
+                'entry': entries[doc_id],
+                'score': round(float(scores[doc_id]), 4),
+                'matched_fields': self._get_matched_fields(doc_id, entries[doc_id], matched_terms, index)
+            }
+            for doc_id in doc_ids.tolist()
+        ]
+    
+    def _get_matched_fields(self, doc_id: int, entry: Dict, terms: List[str],
+                            index: Dict[str, Postings]) -> List[str]:
+        """
+        Get list of fields that contain any of the indexed query terms. Content is not
+        re-tokenized: a term's posting weight minus what the short fields contribute
+        is its count in the content.
+        """
+        field_counts = {}
+        for field in ('title', 'key_terms', 'main_category'):
+            value = _lowercase_field(entry, field)
+            if isinstance(value, list):
+                value = ' '.join(value)
+            field_counts[field] = Counter(_TOKEN_RE.findall(value))
+        
+        matched = set()
+        for term in terms:
+            doc_ids, tfs = index[term]
+            position = np.searchsorted(doc_ids, doc_id)
+            if position == len(doc_ids) or doc_ids[position] != doc_id:
+                continue
+            weight = int(tfs[position])
+            for field, counts in field_counts.items():
+                if counts[term]:
+                    matched.add(field)
+                    weight -= INDEX_FIELD_WEIGHTS[field] * counts[term]
+            if weight > 0:
+                matched.add('content')
+        
+        fields = {
+            'title': 'title',
+            'content': 'content',
+            'category': 'main_category'
+        }
+        return [name for name, field in fields.items() if field in matched]
+
+class BufferedProcessedStore:
+    """
+    Buffer newly processed entries in memory and merge them into a processed data file in batches
+    """
+    
+    def __init__(self, processor: DataProcessor, filename: str = "processed_data_latest.json", flush_every: int = 50):
+        self.processor = processor
+        self.filename = filename
+        self.flush_every = flush_every
+        self.buffer: List[Dict] = []
+        self._lock = threading.Lock()
+    
+    def add(self, entries: List[Dict]) -> Optional[str]:
+        """Buffer entries, flushing once the buffer reaches `flush_every`. Returns the path if flushed."""
+        with self._lock:
+            self.buffer.extend(entries)
+            if len(self.buffer) < self.flush_every:
+                return None
+            return self._flush_locked()
     
-    def _get_matched_fields(self, entry: Dict, query: str) -> List[str]:
-        """Get list of fields that matched the query"""
-        matched = []
-        
-        if query in entry.get('title', '').lower():
-            matched.append('title')
-        if query in entry.get('content', '').lower():
-            matched.append('content')
-        if query in entry.get('main_category', '').lower():
-            matched.append('category')
-        
-        return matched
+    def flush(self) -> Optional[str]:
+        """Write any buffered entries to disk. Returns the path, or None if nothing was buffered."""
+        with self._lock:
+            return self._flush_locked()
+    
+    def _flush_locked(self) -> Optional[str]:
+        if not self.buffer:
+            return None
+        
+        # Newer entries replace older ones for the same URL
+        merged = {}
+        for entry in self.processor.load_processed_data(self.filename) + self.buffer:
+            merged[entry.get('url') or id(entry)] = entry
+        
+        filepath = self.processor.save_processed_data(list(merged.values()), self.filename)
+        logger.info(f"Flushed {len(self.buffer)} buffered entries to {filepath}")
+        self.buffer = []
+        return filepath
 
 # Example usage
 if __name__ == "__main__":
@@ -1,95 +1,472 @@
 import openai
 import os
-from typing import List, Dict, Optional
+import asyncio
+import functools
+import hashlib
+import re
+import string
+import time
+from collections import Counter
+from typing import AsyncIterator, Awaitable, Callable, Final, List, Dict, NamedTuple, Optional, Tuple
 import logging
+import joblib
+import numpy as np
+import orjson
 from dotenv import load_dotenv
+from scipy.sparse import csc_matrix, load_npz, save_npz
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
 
-load_dotenv()
+from app.services.semantic_cache import SemanticCache
+
+# Deployments that inject the environment directly set SKIP_DOTENV=1 to skip parsing .env
+if os.getenv("SKIP_DOTENV") != "1":
+    load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Read once at import instead of on every LLMService construction
+_API_KEY = os.getenv("OPENAI_API_KEY")
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# The embedding model accepts at most 8191 tokens per input. Longer texts are cut to this
+# many characters, which at ~3 characters per token stays under the limit for prose
+EMBEDDING_MAX_CHARS = 24000
+
+# Batch API jobs are checked this often (seconds) until they reach a terminal status
+BATCH_POLL_INTERVAL = 60
+_BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# Answers scoring below this are not added to the semantic cache, so a weak
+# answer doesn't keep being served in place of a better one
+CACHE_MIN_CONFIDENCE = 0.5
+
+# Model routing: short or simple questions go to the fast model first, and fall back
+# to the strong model when the fast model's answer scores below FALLBACK_CONFIDENCE
+FAST_MODEL = "gpt-4o-mini"
+STRONG_MODEL = "gpt-4"
+ROUTING_WORD_LIMIT = 200
+FALLBACK_CONFIDENCE = 0.5
+ROUTE_CACHE_SIZE = 10000
+_SIMPLE_QUESTION_RE = re.compile(r"^\s*(who|what|where|when)\s+(is|are|was|were)\b", re.IGNORECASE)
+
+# Chat completions allowed in flight at once from the async methods, to stay under the rate limit
+MAX_CONCURRENT_COMPLETIONS = 16
+
+# Prompts, kept as module constants so every request sends identical text.
+# The system prompts open every request, and OpenAI's prompt cache matches on an exact
+# token prefix: changing even their whitespace invalidates the cached prefix
+SYSTEM_PROMPT: Final[str] = "You are a knowledgeable assistant about Warhammer 40K lore. Answer questions based on the provided context from the Lexicanum wiki. Be accurate, detailed, and cite your sources when possible."
+
+PROMPT_TEMPLATE = string.Template("""
+Context from Warhammer 40K Lexicanum:
+$context
+
+Question: $question
+
+Please provide a detailed answer based on the context above. If the context doesn't contain enough information to answer the question, please say so and provide what information is available.
+""")
+
+SYSTEM_PROMPT_ENHANCED: Final[str] = """You are a knowledgeable expert on Warhammer 40K lore. You have access to information from the Lexicanum wiki, which is a comprehensive source for Warhammer 40K information.
+
+Guidelines for answering:
+1. Be accurate and detailed in your responses
+2. Use proper Warhammer 40K terminology and names
+3. If the context doesn't contain enough information, say so clearly
+4. Provide specific examples and details when available
+5. Maintain the grimdark tone appropriate to the setting
+6. Cite specific sources when possible
+7. If asked about something not in the context, explain what you know and suggest where to find more information
+
+Always be helpful and informative while staying true to the established lore."""
+
+PROMPT_TEMPLATE_ENHANCED = string.Template("""Context from Warhammer 40K Lexicanum:
+$context
+
+Question: $question
+
+Please provide a detailed and accurate answer based on the context above. If the context doesn't contain enough information to fully answer the question, please provide what information is available and suggest where to find more details.""")
+
+# Relevance weights used by find_relevant_context
+CONTENT_WEIGHT = 50  # scales the tf-idf cosine similarity, which lies in [0, 1]
+TITLE_WEIGHT = 20
+KEY_TERM_WEIGHT = 15
+CATEGORY_WEIGHT = 10
+PHRASE_WEIGHT = 25
+
+# Phrases that mark an answer as low-information
+LOW_INFORMATION_PHRASES = ["don't know", "not enough information"]
+
+# Specific indicators of confidence
+CONFIDENCE_INDICATORS = [
+    "according to", "as mentioned", "specifically", "in particular",
+    "the lore states", "it is known that", "can be found"
+]
+
+# Every phrase above in one case-insensitive pattern, so an answer is scanned once
+_CONFIDENCE_PHRASES_RE = re.compile(
+    '|'.join(re.escape(phrase) for phrase in LOW_INFORMATION_PHRASES + CONFIDENCE_INDICATORS),
+    re.IGNORECASE
+)
+
+_URL_RE = re.compile(r'https?://[^\s]+')
+
+def _embedding_input(text: str) -> str:
+    """Text cut to what the embedding model accepts in one input"""
+    return text[:EMBEDDING_MAX_CHARS]
+
+@functools.lru_cache(maxsize=1024)
+def _token_set(text: str) -> frozenset:
+    """Lowercased whitespace tokens of a text, memoized since the same context is scored repeatedly"""
+    return frozenset(text.lower().split())
+
+def _scan_confidence_phrases(answer: str) -> Tuple[bool, int]:
+    """Whether the answer admits missing information, and how many distinct confidence indicators it uses"""
+    found = {match.group().lower() for match in _CONFIDENCE_PHRASES_RE.finditer(answer)}
+    low_information = any(phrase in found for phrase in LOW_INFORMATION_PHRASES)
+    return low_information, sum(1 for indicator in CONFIDENCE_INDICATORS if indicator in found)
+
+class _ScoringContext(NamedTuple):
+    """Features of an answer shared by both confidence scores, computed once per answer"""
+    has_answer: bool
+    answer_tokens: frozenset
+    context_tokens: frozenset
+    low_information: bool
+    confidence_boost: int
+
+def _scoring_context(answer: Optional[str], context: str) -> _ScoringContext:
+    answer = answer or ""
+    low_information, confidence_boost = _scan_confidence_phrases(answer)
+    return _ScoringContext(
+        has_answer=bool(answer),
+        answer_tokens=frozenset(answer.lower().split()),
+        context_tokens=_token_set(context),
+        low_information=low_information,
+        confidence_boost=confidence_boost
+    )
+
+class _AnswerVariant(NamedTuple):
+    """How one style of answer is prompted, scored and sourced"""
+    name: str
+    system_prompt: str
+    template: string.Template
+    max_tokens: int
+    score: Callable[[_ScoringContext], float]
+    sources: Callable[[str], List[str]]
+
+def _not_configured_result() -> Dict:
+    return {
+        "answer": "LLM service not configured. Please set OPENAI_API_KEY environment variable.",
+        "confidence": 0.0,
+        "sources": []
+    }
+
+def _error_result(error: Exception) -> Dict:
+    return {
+        "answer": f"Error generating answer: {str(error)}",
+        "confidence": 0.0,
+        "sources": []
+    }
+
+def _knowledge_base_fingerprint(knowledge_base: List[Dict]) -> str:
+    """Identify a knowledge base by the text of every field the index is built from"""
+    digest = hashlib.blake2b(digest_size=16)
+    for entry in knowledge_base:
+        fields = (
+            entry.get('content', ''),
+            entry.get('title', ''),
+            '\x1d'.join(entry.get('key_terms', [])),
+            entry.get('main_category', '')
+        )
+        digest.update(('\x1f'.join(fields) + '\x1e').encode('utf-8'))
+    return digest.hexdigest()
+
+def _contents_lower(knowledge_base: List[Dict]) -> List[str]:
+    """Lowercased entry content, using the copy stored on processed entries when present"""
+    return [entry.get('_content_lc') or entry.get('content', '').lower() for entry in knowledge_base]
+
+class _KnowledgeBaseIndex(NamedTuple):
+    """Vectorized knowledge base used by find_relevant_context"""
+    knowledge_base: Optional[List[Dict]]
+    fingerprint: str
+    vectorizer: TfidfVectorizer
+    content_idf: np.ndarray
+    content_matrix: csc_matrix
+    field_vectorizer: CountVectorizer
+    title_matrix: csc_matrix
+    key_terms_matrix: csc_matrix
+    category_matrix: csc_matrix
+    contents_lower: Optional[List[str]]
+
+# Files written by LLMService.save_kb_index
+_KB_MATRIX_FILES = {
+    'content_matrix': 'kb_tfidf.npz',
+    'title_matrix': 'kb_titles.npz',
+    'key_terms_matrix': 'kb_key_terms.npz',
+    'category_matrix': 'kb_categories.npz'
+}
+_KB_VECTORIZERS_FILE = 'kb_vectorizers.joblib'
+
+def _query_terms(vectorizer: CountVectorizer, text: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Vocabulary ids of the terms in text and their counts, tokenized as the fitted vectorizer does"""
+    vocabulary = vectorizer.vocabulary_
+    counts = Counter(vocabulary[term] for term in vectorizer.build_analyzer()(text) if term in vocabulary)
+    return (np.fromiter(counts.keys(), dtype=np.int64, count=len(counts)),
+            np.fromiter(counts.values(), dtype=np.float64, count=len(counts)))
+
+def _dot_columns(matrix: csc_matrix, columns: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """matrix @ q for a sparse query q, reading only the matrix columns of q's terms"""
+    return matrix[:, columns] @ weights
+
 class LLMService:
     """
     Service for integrating with Large Language Models
     """
     
-    def __init__(self, api_key: Optional[str] = None):
-        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+    def __init__(self, api_key: Optional[str] = None, cache_threshold: float = 0.95,
+                 cache_size: int = 10000, cache_path: Optional[str] = None,
+                 index_path: Optional[str] = None,
+                 max_concurrency: int = MAX_CONCURRENT_COMPLETIONS):
+        self.api_key = api_key or _API_KEY
+        self._aclient: Optional[openai.AsyncOpenAI] = None
         if self.api_key:
             openai.api_key = self.api_key
+            # One async client, so concurrent requests share its connection pool
+            self._aclient = openai.AsyncOpenAI(api_key=self.api_key)
         else:
             logger.warning("No OpenAI API key found. Set OPENAI_API_KEY environment variable.")
+        self._completion_semaphore = asyncio.Semaphore(max_concurrency)
+        
+        # The two answer styles, generated by the same code path
+        self._basic_variant = _AnswerVariant(
+            "answer", SYSTEM_PROMPT, PROMPT_TEMPLATE, 1000,
+            self._calculate_confidence, self._extract_sources
+        )
+        self._enhanced_variant = _AnswerVariant(
+            "enhanced answer", SYSTEM_PROMPT_ENHANCED, PROMPT_TEMPLATE_ENHANCED, 1500,
+            self._calculate_enhanced_confidence, self._extract_sources_from_context
+        )
+        
+        # Model chosen for each question, keyed by a hash of the normalized question
+        self._model_routes: Dict[bytes, str] = {}
+        
+        # Async answers being generated, so concurrent identical requests share one LLM call
+        self._inflight: Dict[str, asyncio.Task] = {}
+        
+        # Answers to semantically equivalent questions are served without an LLM call
+        self.semantic_cache = SemanticCache(threshold=cache_threshold, max_size=cache_size)
+        
+        # Vectorized knowledge base for context retrieval, rebuilt when a different list is passed.
+        # A prebuilt index saved with save_kb_index is adopted if it matches the knowledge base.
+        self._kb_index: Optional[_KnowledgeBaseIndex] = None
+        if index_path:
+            try:
+                self._kb_index = self._load_kb_index(index_path)
+            except FileNotFoundError:
+                logger.info(f"No knowledge base index found in {index_path}")
+            except Exception as e:
+                logger.error(f"Error loading knowledge base index from {index_path}: {str(e)}")
+        self.cache_path = cache_path
+        if cache_path:
+            try:
+                self.semantic_cache.load(cache_path)
+            except Exception as e:
+                logger.error(f"Error loading semantic cache {cache_path}: {str(e)}")
     
-    def generate_answer(self, question: str, context: str, model: str = "gpt-4") -> Dict:
+    def save_semantic_cache(self) -> None:
+        """Persist the semantic cache if a cache path was configured"""
+        if self.cache_path:
+            self.semantic_cache.save(self.cache_path)
+    
+    def generate_answer(self, question: str, context: str, model: Optional[str] = None) -> Dict:
+        """
+        Generate an answer to a question using provided context.
+        Without an explicit model, the model is picked by _route_model.
         """
-        Generate an answer to a question using provided context
+        return self._generate(self._basic_variant, question, context, model)
+    
+    async def agenerate_answer(self, question: str, context: str, model: Optional[str] = None) -> Dict:
         """
+        Async version of generate_answer, so concurrent questions overlap their LLM calls
+        """
+        return await self._coalesced(
+            (self._basic_variant.name, question, context, model),
+            lambda: self._agenerate(self._basic_variant, question, context, model)
+        )
+    
+    def _generate(self, variant: _AnswerVariant, question: str, context: str, model: Optional[str]) -> Dict:
+        """Generate an answer in the given variant, shared by the sync answer methods"""
         try:
             if not self.api_key:
-                return {
-                    "answer": "LLM service not configured. Please set OPENAI_API_KEY environment variable.",
-                    "confidence": 0.0,
-                    "sources": []
-                }
+                return _not_configured_result()
+            
+            question_embedding = self.generate_embeddings(question)
+            cached = self.semantic_cache.lookup(question_embedding, self._cache_key(variant, context))
+            if cached:
+                return cached
             
-            prompt = self._build_prompt(question, context)
+            user_prompt = variant.template.substitute(context=context, question=question)
+            model, routed = self._first_model(question, context, model)
+            answer = self._complete(model, variant.system_prompt, user_prompt, variant.max_tokens)
+            confidence = variant.score(_scoring_context(answer, context))
             
-            response = openai.ChatCompletion.create(
+            fallback = self._fallback_model(question, model, routed, confidence)
+            if fallback:
+                answer = self._complete(fallback, variant.system_prompt, user_prompt, variant.max_tokens)
+                confidence = variant.score(_scoring_context(answer, context))
+            
+            return self._finish(variant, question_embedding, answer, confidence, context)
+            
+        except Exception as e:
+            logger.error(f"Error generating {variant.name}: {str(e)}")
+            return _error_result(e)
+    
+    async def _agenerate(self, variant: _AnswerVariant, question: str, context: str, model: Optional[str]) -> Dict:
+        """Async version of _generate"""
+        try:
+            if not self.api_key:
+                return _not_configured_result()
+            
+            question_embedding = await self._agenerate_embedding(question)
+            # The cache scans every stored embedding under a lock, so it runs off the event loop
+            cached = await asyncio.to_thread(self.semantic_cache.lookup, question_embedding, self._cache_key(variant, context))
+            if cached:
+                return cached
+            
+            user_prompt = variant.template.substitute(context=context, question=question)
+            model, routed = self._first_model(question, context, model)
+            answer = await self._acomplete(model, variant.system_prompt, user_prompt, variant.max_tokens)
+            confidence = variant.score(_scoring_context(answer, context))
+            
+            fallback = self._fallback_model(question, model, routed, confidence)
+            if fallback:
+                answer = await self._acomplete(fallback, variant.system_prompt, user_prompt, variant.max_tokens)
+                confidence = variant.score(_scoring_context(answer, context))
+            
+            return await asyncio.to_thread(self._finish, variant, question_embedding, answer, confidence, context)
+            
+        except Exception as e:
+            logger.error(f"Error generating {variant.name}: {str(e)}")
+            return _error_result(e)
+    
+    def _finish(self, variant: _AnswerVariant, question_embedding: List[float], answer: str,
+                confidence: float, context: str) -> Dict:
+        """Build the result for a generated answer and add it to the semantic cache if it scored well"""
+        result = {
+            "answer": answer,
+            "confidence": confidence,
+            "sources": variant.sources(context)
+        }
+        if confidence >= CACHE_MIN_CONFIDENCE:
+            self.semantic_cache.add(question_embedding, result, self._cache_key(variant, context))
+        return result
+    
+    def _cache_key(self, variant: _AnswerVariant, context: str) -> str:
+        """
+        Semantic cache partition for an answer: its variant and the exact context it was
+        generated from, so a rebuilt corpus or a different retrieval never reuses it
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{variant.name}\x1f{context}".encode("utf-8"))
+        return digest.hexdigest()
+    
+    def _route_model(self, question: str, context: str) -> str:
+        """
+        Pick the model for a question: the fast model for short prompts and simple
+        factual questions, the strong model otherwise. Decisions are cached per question.
+        """
+        key = self._route_key(question)
+        model = self._model_routes.get(key)
+        if model is None:
+            short = len(context.split()) + len(question.split()) < ROUTING_WORD_LIMIT
+            model = FAST_MODEL if short or _SIMPLE_QUESTION_RE.match(question) else STRONG_MODEL
+            self._set_route(key, model)
+        return model
+    
+    def _route_key(self, question: str) -> bytes:
+        return hashlib.blake2b(" ".join(question.lower().split()).encode("utf-8"), digest_size=16).digest()
+    
+    def _set_route(self, key: bytes, model: str) -> None:
+        if key not in self._model_routes and len(self._model_routes) >= ROUTE_CACHE_SIZE:
+            # Drop the oldest decision; dicts keep insertion order
+            del self._model_routes[next(iter(self._model_routes))]
+        self._model_routes[key] = model
+    
+    def _first_model(self, question: str, context: str, model: Optional[str]) -> Tuple[str, bool]:
+        """The model to try first, and whether it was routed rather than given explicitly"""
+        if model is not None:
+            return model, False
+        return self._route_model(question, context), True
+    
+    def _fallback_model(self, question: str, model: str, routed: bool, confidence: float) -> Optional[str]:
+        """
+        The strong model when a routed answer scored below FALLBACK_CONFIDENCE, else None.
+        The question is routed to the strong model from then on.
+        """
+        if not routed or model == STRONG_MODEL or confidence >= FALLBACK_CONFIDENCE:
+            return None
+        self._set_route(self._route_key(question), STRONG_MODEL)
+        return STRONG_MODEL
+    
+    def _complete(self, model: str, system_prompt: str, user_prompt: str, max_tokens: int) -> str:
+        """Run one chat completion"""
+        response = openai.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            max_tokens=max_tokens,
+            temperature=0.7
+        )
+        return response.choices[0].message.content
+    
+    async def _coalesced(self, request: Tuple, generate: Callable[[], Awaitable[Dict]]) -> Dict:
+        """
+        Run generate() for a request unless an identical request is already in flight,
+        in which case wait for that one's result instead of making another LLM call
+        """
+        key = hashlib.sha256("||".join(str(part) for part in request).encode("utf-8")).hexdigest()
+        task = self._inflight.get(key)
+        if task is None:
+            # The call runs in its own task so no single caller owns it
+            task = asyncio.create_task(generate())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        
+        # Shielded so a caller that is cancelled stops waiting without cancelling the call
+        # for the other callers
+        return await asyncio.shield(task)
+    
+    async def _acomplete(self, model: str, system_prompt: str, user_prompt: str, max_tokens: int) -> str:
+        """Run one chat completion on the shared async client, bounded by the concurrency limit"""
+        async with self._completion_semaphore:
+            response = await self._aclient.chat.completions.create(
                 model=model,
                 messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a knowledgeable assistant about Warhammer 40K lore. Answer questions based on the provided context from the Lexicanum wiki. Be accurate, detailed, and cite your sources when possible."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
                 ],
-                max_tokens=1000,
+                max_tokens=max_tokens,
                 temperature=0.7
             )
-            
-            answer = response.choices[0].message.content
-            confidence = self._calculate_confidence(answer, context)
-            
-            return {
-                "answer": answer,
-                "confidence": confidence,
-                "sources": self._extract_sources(context)
-            }
-            
-        except Exception as e:
-            logger.error(f"Error generating answer: {str(e)}")
-            return {
-                "answer": f"Error generating answer: {str(e)}",
-                "confidence": 0.0,
-                "sources": []
-            }
-    
-    def _build_prompt(self, question: str, context: str) -> str:
-        """Build the prompt for the LLM"""
-        return f"""
-Context from Warhammer 40K Lexicanum:
-{context}
-
-Question: {question}
-
-Please provide a detailed answer based on the context above. If the context doesn't contain enough information to answer the question, please say so and provide what information is available.
-"""
+        return response.choices[0].message.content
     
-    def _calculate_confidence(self, answer: str, context: str) -> float:
+    async def _agenerate_embedding(self, text: str) -> List[float]:
+        """Embedding of a single text from the async client, or an empty list on failure"""
+        embeddings = await self.agenerate_embeddings_batch([text])
+        return embeddings[0] if embeddings else []
+    
+    def _calculate_confidence(self, scoring: _ScoringContext) -> float:
         """
         Calculate confidence score based on answer quality and context relevance
         This is a simple heuristic - in production, you might want more sophisticated scoring
         """
-        if not answer or "don't know" in answer.lower() or "not enough information" in answer.lower():
+        if not scoring.has_answer or scoring.low_information:
             return 0.3
         
         # Simple confidence based on answer length and context usage
-        context_words = set(context.lower().split())
-        answer_words = set(answer.lower().split())
-        overlap = len(context_words.intersection(answer_words))
+        overlap = len(scoring.context_tokens & scoring.answer_tokens)
         
         if overlap > 5:
             return 0.8
@@ -108,180 +485,383 @@ Please provide a detailed answer based on the context above. If the context does
         """
         Generate embeddings for text using OpenAI's embedding model
         """
+        embeddings = self.generate_embeddings_batch([text])
+        return embeddings[0] if embeddings else []
+    
+    def generate_embeddings_batch(self, texts: List[str], batch_size: int = 512) -> List[List[float]]:
+        """
+        Generate embeddings for many texts, sending up to `batch_size` inputs per request.
+        Returns one embedding per text in input order, or an empty list on failure.
+        """
         try:
-            if not self.api_key:
+            if not self.api_key or not texts:
                 return []
             
-            response = openai.Embedding.create(
-                model="text-embedding-ada-002",
-                input=text
-            )
+            embeddings = []
+            for i in range(0, len(texts), batch_size):
+                response = openai.embeddings.create(
+                    model=EMBEDDING_MODEL, input=[_embedding_input(text) for text in texts[i:i + batch_size]]
+                )
+                embeddings.extend(self._embeddings_from_response(response))
+            return embeddings
             
-            return response.data[0].embedding
+        except Exception as e:
+            logger.error(f"Error generating embeddings: {str(e)}")
+            return []
+    
+    async def agenerate_embeddings_batch(self, texts: List[str], batch_size: int = 512,
+                                         max_concurrency: int = 5) -> List[List[float]]:
+        """
+        Async version of generate_embeddings_batch on the shared async client.
+        Up to `max_concurrency` requests are in flight at once, to avoid rate limiting.
+        """
+        try:
+            if not self.api_key or not texts:
+                return []
+            
+            semaphore = asyncio.Semaphore(max_concurrency)
+            
+            async def embed(chunk: List[str]):
+                async with semaphore:
+                    return await self._aclient.embeddings.create(
+                        model=EMBEDDING_MODEL, input=[_embedding_input(text) for text in chunk]
+                    )
+            
+            responses = await asyncio.gather(*[
+                embed(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)
+            ])
+            return [embedding for response in responses for embedding in self._embeddings_from_response(response)]
             
         except Exception as e:
             logger.error(f"Error generating embeddings: {str(e)}")
             return []
     
-    def find_relevant_context(self, question: str, knowledge_base: List[Dict]) -> str:
+    def generate_embeddings_batch_api(self, texts: Dict[str, str], input_path: str,
+                                      poll_interval: float = BATCH_POLL_INTERVAL) -> Dict[str, List[float]]:
         """
-        Find the most relevant context from the knowledge base for a question
+        Embed texts through the OpenAI Batch API, which costs less than the synchronous
+        endpoint but can take up to 24 hours. Blocks until the batch finishes.
+        `texts` maps a unique id to its text; returns the embedding for each id that succeeded.
         """
-        question_lower = question.lower()
-        question_words = set(question_lower.split())
-        
-        scored_entries = []
-        
-        for entry in knowledge_base:
-            score = 0
-            content = entry.get('content', '').lower()
-            title = entry.get('title', '').lower()
-            key_terms = [term.lower() for term in entry.get('key_terms', [])]
-            category = entry.get('main_category', '').lower()
+        try:
+            if not self.api_key or not texts:
+                return {}
             
-            # Title match (highest weight)
-            if any(word in title for word in question_words):
-                score += 20
+            # One embeddings request per line, tagged with its id
+            with open(input_path, 'wb') as f:
+                for custom_id, text in texts.items():
+                    f.write(orjson.dumps({
+                        "custom_id": custom_id,
+                        "method": "POST",
+                        "url": "/v1/embeddings",
+                        "body": {"model": EMBEDDING_MODEL, "input": _embedding_input(text)}
+                    }, option=orjson.OPT_APPEND_NEWLINE))
             
-            # Key terms match
-            for term in key_terms:
-                if any(word in term for word in question_words):
-                    score += 15
+            with open(input_path, 'rb') as f:
+                input_file = openai.files.create(file=f, purpose="batch")
+            batch = openai.batches.create(
+                input_file_id=input_file.id, endpoint="/v1/embeddings", completion_window="24h"
+            )
+            logger.info(f"Submitted embedding batch {batch.id} with {len(texts)} requests")
+            
+            while batch.status not in _BATCH_TERMINAL_STATUSES:
+                time.sleep(poll_interval)
+                batch = openai.batches.retrieve(batch.id)
             
-            # Content match
-            content_overlap = len(question_words.intersection(set(content.split())))
-            score += content_overlap * 2
+            if batch.status != "completed" or not batch.output_file_id:
+                logger.error(f"Embedding batch {batch.id} ended with status {batch.status}")
+                return {}
             
-            # Category match
-            if any(word in category for word in question_words):
-                score += 10
+            embeddings = {}
+            for line in openai.files.content(batch.output_file_id).text.splitlines():
+                result = orjson.loads(line)
+                response = result.get("response")
+                if response and response.get("status_code") == 200:
+                    embeddings[result["custom_id"]] = response["body"]["data"][0]["embedding"]
             
-            # Phrase matching
-            if question_lower in content:
-                score += 25
+            if len(embeddings) < len(texts):
+                logger.warning(f"Embedding batch {batch.id}: {len(texts) - len(embeddings)} requests failed")
+            return embeddings
             
-            if score > 0:
-                scored_entries.append({
-                    'entry': entry,
-                    'score': score,
-                    'content': entry.get('content', ''),
-                    'title': entry.get('title', ''),
-                    'url': entry.get('url', '')
-                })
+        except Exception as e:
+            logger.error(f"Error generating embeddings with the Batch API: {str(e)}")
+            return {}
+    
+    def _embeddings_from_response(self, response) -> List[List[float]]:
+        """Embeddings from an API response, ordered like the request inputs"""
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    
+    def _build_kb_index(self, knowledge_base: List[Dict]) -> _KnowledgeBaseIndex:
+        """
+        Vectorize the knowledge base: a tf-idf matrix over content, binary
+        term-presence matrices over titles, key terms and categories, and
+        lowercased content for phrase matching
+        """
+        contents_lower = _contents_lower(knowledge_base)
+        
+        vectorizer = TfidfVectorizer(lowercase=False, ngram_range=(1, 2))
+        content_matrix = vectorizer.fit_transform(contents_lower)
+        
+        titles = [entry.get('title', '') for entry in knowledge_base]
+        key_terms = [' '.join(entry.get('key_terms', [])) for entry in knowledge_base]
+        categories = [entry.get('main_category', '') for entry in knowledge_base]
+        field_vectorizer = CountVectorizer(lowercase=True, binary=True).fit(titles + key_terms + categories)
+        
+        return _KnowledgeBaseIndex(
+            knowledge_base=knowledge_base,
+            fingerprint=_knowledge_base_fingerprint(knowledge_base),
+            vectorizer=vectorizer,
+            content_idf=vectorizer.idf_,
+            content_matrix=content_matrix.tocsc(),
+            field_vectorizer=field_vectorizer,
+            title_matrix=field_vectorizer.transform(titles).tocsc(),
+            key_terms_matrix=field_vectorizer.transform(key_terms).tocsc(),
+            category_matrix=field_vectorizer.transform(categories).tocsc(),
+            contents_lower=contents_lower
+        )
+    
+    def save_kb_index(self, knowledge_base: List[Dict], index_path: str) -> None:
+        """
+        Vectorize the knowledge base and write it to `index_path`, so services
+        started with that path skip re-tokenizing the same data
+        """
+        index = self._kb_index
+        if index is None or index.knowledge_base is not knowledge_base:
+            index = self._kb_index = self._build_kb_index(knowledge_base)
+        
+        os.makedirs(index_path, exist_ok=True)
+        for field, filename in _KB_MATRIX_FILES.items():
+            save_npz(os.path.join(index_path, filename), getattr(index, field))
+        joblib.dump(
+            {
+                'fingerprint': index.fingerprint,
+                'vectorizer': index.vectorizer,
+                'field_vectorizer': index.field_vectorizer
+            },
+            os.path.join(index_path, _KB_VECTORIZERS_FILE)
+        )
+        logger.info(f"Saved knowledge base index for {len(knowledge_base)} entries to {index_path}")
+    
+    def _load_kb_index(self, index_path: str) -> _KnowledgeBaseIndex:
+        """Load an index written by save_kb_index; it is bound to a knowledge base on first use"""
+        vectorizers = joblib.load(os.path.join(index_path, _KB_VECTORIZERS_FILE))
+        matrices = {
+            field: load_npz(os.path.join(index_path, filename)).tocsc()
+            for field, filename in _KB_MATRIX_FILES.items()
+        }
+        logger.info(f"Loaded knowledge base index from {index_path}")
+        return _KnowledgeBaseIndex(
+            knowledge_base=None,
+            fingerprint=vectorizers['fingerprint'],
+            vectorizer=vectorizers['vectorizer'],
+            content_idf=vectorizers['vectorizer'].idf_,
+            field_vectorizer=vectorizers['field_vectorizer'],
+            contents_lower=None,
+            **matrices
+        )
+    
+    def _index_for(self, knowledge_base: List[Dict]) -> _KnowledgeBaseIndex:
+        """Return the index for this knowledge base, adopting a loaded index or building a new one"""
+        index = self._kb_index
+        if index is not None and index.knowledge_base is knowledge_base:
+            return index
+        
+        if index is not None and index.fingerprint == _knowledge_base_fingerprint(knowledge_base):
+            index = index._replace(knowledge_base=knowledge_base, contents_lower=_contents_lower(knowledge_base))
+        else:
+            index = self._build_kb_index(knowledge_base)
+        
+        self._kb_index = index
+        return index
+    
+    def _phrase_candidates(self, index: _KnowledgeBaseIndex, question_lower: str, scores: np.ndarray) -> np.ndarray:
+        """
+        Entries that may contain the whole question. The question's first and last
+        words can be parts of longer words in an entry, but every term between them
+        is a whole word there, so an entry containing the question has all of those
+        terms. Without such terms, every entry that scored is a candidate.
+        """
+        tokens = index.vectorizer.build_tokenizer()(question_lower)[1:-1]
+        inner_terms = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        if not inner_terms:
+            return np.flatnonzero(scores > 0)
+        
+        vocabulary = index.vectorizer.vocabulary_
+        if any(term not in vocabulary for term in inner_terms):
+            # No entry has that term, so none contains the question
+            return np.empty(0, dtype=np.int64)
+        columns = np.unique([vocabulary[term] for term in inner_terms])
+        return np.flatnonzero(index.content_matrix[:, columns].getnnz(axis=1) == len(columns))
+    
+    def find_relevant_context(self, question: str, knowledge_base: List[Dict]) -> str:
+        """
+        Find the most relevant context from the knowledge base for a question
+        """
+        if not knowledge_base:
+            return ""
         
-        # Sort by score and take top entries
-        scored_entries.sort(key=lambda x: x['score'], reverse=True)
+        try:
+            index = self._index_for(knowledge_base)
+        except ValueError as e:
+            # Raised by the vectorizers when the knowledge base has no usable terms
+            logger.warning(f"Could not index knowledge base: {str(e)}")
+            return ""
+        
+        question_lower = question.lower()
+        
+        # The question is weighted like vectorizer.transform would, but with the idf cached
+        # on the index, and every product only reads the columns of the question's terms
+        
+        # Content relevance: cosine similarity of l2-normalized tf-idf rows
+        content_terms, counts = _query_terms(index.vectorizer, question_lower)
+        weights = counts * index.content_idf[content_terms]
+        norm = np.linalg.norm(weights)
+        scores = CONTENT_WEIGHT * _dot_columns(index.content_matrix, content_terms, weights / norm if norm else weights)
+        
+        # Field matches; the field vectorizer is binary, so every question term weighs 1
+        terms, _ = _query_terms(index.field_vectorizer, question_lower)
+        ones = np.ones(len(terms))
+        scores += TITLE_WEIGHT * (_dot_columns(index.title_matrix, terms, ones) > 0)
+        scores += KEY_TERM_WEIGHT * _dot_columns(index.key_terms_matrix, terms, ones)
+        scores += CATEGORY_WEIGHT * (_dot_columns(index.category_matrix, terms, ones) > 0)
+        
+        # Phrase matching
+        for i in self._phrase_candidates(index, question_lower, scores):
+            if question_lower in index.contents_lower[i]:
+                scores[i] += PHRASE_WEIGHT
+        
+        # Take the top 3 scoring entries without sorting the whole knowledge base; only
+        # entries that scored at all are candidates. Every entry tied with the 3rd best
+        # score is kept before the stable sort, so ties go to the earliest entries
+        candidates = np.flatnonzero(scores > 0)
+        if not len(candidates):
+            return ""
+        candidate_scores = scores[candidates]
+        k = min(3, len(candidates))
+        kth_score = np.partition(candidate_scores, len(candidates) - k)[len(candidates) - k]
+        top = candidates[candidate_scores >= kth_score]
+        top = top[np.argsort(-scores[top], kind='stable')][:k]
         
         # Combine top 3 entries for context
         context_parts = []
-        for entry in scored_entries[:3]:
-            context_parts.append(f"Title: {entry['title']}\nContent: {entry['content'][:1000]}...")
+        for i in top:
+            entry = knowledge_base[i]
+            context_parts.append(f"Title: {entry.get('title', '')}\nContent: {entry.get('content', '')[:1000]}...")
         
         return "\n\n".join(context_parts)[:3000]  # Limit total context length
     
-    def generate_enhanced_answer(self, question: str, context: str, model: str = "gpt-4") -> Dict:
+    def generate_enhanced_answer(self, question: str, context: str, model: Optional[str] = None) -> Dict:
         """
-        Generate an enhanced answer with better prompting
+        Generate an enhanced answer with better prompting.
+        Without an explicit model, the model is picked by _route_model.
         """
+        return self._generate(self._enhanced_variant, question, context, model)
+    
+    async def agenerate_enhanced_answer(self, question: str, context: str, model: Optional[str] = None) -> Dict:
+        """
+        Async version of generate_enhanced_answer, so concurrent questions overlap their LLM calls
+        """
+        return await self._coalesced(
+            (self._enhanced_variant.name, question, context, model),
+            lambda: self._agenerate(self._enhanced_variant, question, context, model)
+        )
+    
+    async def astream_answer(self, question: str, context: str, model: str = STRONG_MODEL) -> AsyncIterator[Dict]:
+        """
+        Stream an enhanced answer as it is generated.
+        Yields {"delta": text} for each chunk of the answer, then one final
+        {"confidence": ..., "sources": [...]} message scored on the full answer.
+        The strong model is the default since a streamed answer can't be retried on it.
+        """
+        variant = self._enhanced_variant
         try:
             if not self.api_key:
-                return {
-                    "answer": "LLM service not configured. Please set OPENAI_API_KEY environment variable.",
-                    "confidence": 0.0,
-                    "sources": []
-                }
+                result = _not_configured_result()
+                yield {"delta": result["answer"]}
+                yield {"confidence": result["confidence"], "sources": result["sources"]}
+                return
             
-            # Enhanced prompt for Warhammer 40K context
-            system_prompt = """You are a knowledgeable expert on Warhammer 40K lore. You have access to information from the Lexicanum wiki, which is a comprehensive source for Warhammer 40K information.
-
-Guidelines for answering:
-1. Be accurate and detailed in your responses
-2. Use proper Warhammer 40K terminology and names
-3. If the context doesn't contain enough information, say so clearly
-4. Provide specific examples and details when available
-5. Maintain the grimdark tone appropriate to the setting
-6. Cite specific sources when possible
-7. If asked about something not in the context, explain what you know and suggest where to find more information
-
-Always be helpful and informative while staying true to the established lore."""
-            
-            user_prompt = f"""Context from Warhammer 40K Lexicanum:
-{context}
-
-Question: {question}
-
-Please provide a detailed and accurate answer based on the context above. If the context doesn't contain enough information to fully answer the question, please provide what information is available and suggest where to find more details."""
-            
-            response = openai.ChatCompletion.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=1500,
-                temperature=0.7
-            )
+            question_embedding = await self._agenerate_embedding(question)
+            cached = await asyncio.to_thread(self.semantic_cache.lookup, question_embedding, self._cache_key(variant, context))
+            if cached:
+                yield {"delta": cached["answer"]}
+                yield {"confidence": cached["confidence"], "sources": cached["sources"]}
+                return
             
-            answer = response.choices[0].message.content
-            confidence = self._calculate_enhanced_confidence(answer, context, question)
-            sources = self._extract_sources_from_context(context)
+            user_prompt = variant.template.substitute(context=context, question=question)
+            # The completion is read in its own task, so the concurrency slot is released as
+            # soon as the model finishes rather than when a slow client has read every chunk
+            deltas: asyncio.Queue = asyncio.Queue()
+            reader = asyncio.create_task(self._aread_stream(model, variant.system_prompt, user_prompt,
+                                                            variant.max_tokens, deltas))
+            parts = []
+            try:
+                while (delta := await deltas.get()) is not None:
+                    parts.append(delta)
+                    yield {"delta": delta}
+            except BaseException:
+                # The client went away; stop reading the completion
+                reader.cancel()
+                raise
+            # Raises any error from reading the completion
+            await reader
             
-            return {
-                "answer": answer,
-                "confidence": confidence,
-                "sources": sources
-            }
+            answer = "".join(parts)
+            confidence = variant.score(_scoring_context(answer, context))
+            result = await asyncio.to_thread(self._finish, variant, question_embedding, answer, confidence, context)
+            yield {"confidence": result["confidence"], "sources": result["sources"]}
             
         except Exception as e:
-            logger.error(f"Error generating enhanced answer: {str(e)}")
-            return {
-                "answer": f"Error generating answer: {str(e)}",
-                "confidence": 0.0,
-                "sources": []
-            }
+            logger.error(f"Error streaming answer: {str(e)}")
+            result = _error_result(e)
+            yield {"delta": result["answer"]}
+            yield {"confidence": result["confidence"], "sources": result["sources"]}
+    
+    async def _aread_stream(self, model: str, system_prompt: str, user_prompt: str, max_tokens: int,
+                            deltas: asyncio.Queue) -> None:
+        """
+        Stream a chat completion into `deltas`, bounded by the concurrency limit.
+        None is queued once the stream ends or fails.
+        """
+        try:
+            async with self._completion_semaphore:
+                stream = await self._aclient.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    max_tokens=max_tokens,
+                    temperature=0.7,
+                    stream=True
+                )
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        deltas.put_nowait(delta)
+        finally:
+            deltas.put_nowait(None)
     
-    def _calculate_enhanced_confidence(self, answer: str, context: str, question: str) -> float:
+    def _calculate_enhanced_confidence(self, scoring: _ScoringContext) -> float:
         """
         Calculate confidence based on answer quality and context relevance
         """
-        if not answer or "don't know" in answer.lower() or "not enough information" in answer.lower():
+        if not scoring.has_answer or scoring.low_information:
             return 0.3
         
-        # Check for specific indicators of confidence
-        confidence_indicators = [
-            "according to", "as mentioned", "specifically", "in particular",
-            "the lore states", "it is known that", "can be found"
-        ]
-        
-        answer_lower = answer.lower()
-        confidence_boost = sum(1 for indicator in confidence_indicators if indicator in answer_lower)
-        
         # Base confidence on context usage
-        context_words = set(context.lower().split())
-        answer_words = set(answer_lower.split())
-        overlap = len(context_words.intersection(answer_words))
+        overlap = len(scoring.context_tokens & scoring.answer_tokens)
         
-        base_confidence = min(0.9, 0.4 + (overlap * 0.05) + (confidence_boost * 0.1))
+        base_confidence = min(0.9, 0.4 + (overlap * 0.05) + (scoring.confidence_boost * 0.1))
         
         return base_confidence
     
     def _extract_sources_from_context(self, context: str) -> List[str]:
         """Extract source URLs from context"""
-        sources = []
-        lines = context.split('\n')
-        
-        for line in lines:
-            if 'url:' in line.lower() or 'http' in line:
-                # Extract URL from line
-                url_match = re.search(r'https?://[^\s]+', line)
-                if url_match:
-                    sources.append(url_match.group())
-        
-        # If no URLs found, return default
-        if not sources:
-            sources = ["https://wh40k.lexicanum.com/wiki/Main_Page"]
-        
-        return sources[:3]  # Limit to top 3 sources
+        # Distinct URLs in order of appearance, limited to the top 3 sources;
+        # if no URLs are found, return the default
+        sources = list(dict.fromkeys(match.group() for match in _URL_RE.finditer(context)))[:3]
+        return sources or ["https://wh40k.lexicanum.com/wiki/Main_Page"]
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+import hashlib
+import logging
+import os
+import time
+from typing import Optional
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for Redis to connect or answer before treating the lookup as a miss
+REDIS_TIMEOUT = 0.25
+
+# Seconds Redis is skipped after an error, so an unreachable server isn't retried on every request
+REDIS_COOLDOWN = 30
+
+class ResponseCache:
+    """
+    Redis-backed cache for serialized API responses.
+    Disabled (every lookup misses) when no Redis URL is configured, and for
+    REDIS_COOLDOWN seconds after Redis fails or doesn't answer within REDIS_TIMEOUT.
+    """
+    
+    def __init__(self, url: Optional[str] = None, ttl: int = 3600):
+        self.ttl = ttl
+        url = url or os.getenv("REDIS_URL")
+        self.client = redis.Redis.from_url(
+            url,
+            decode_responses=False,
+            socket_connect_timeout=REDIS_TIMEOUT,
+            socket_timeout=REDIS_TIMEOUT
+        ) if url else None
+        if self.client is None:
+            logger.info("REDIS_URL not set; response caching disabled")
+        
+        # time.monotonic() before which Redis is skipped
+        self._retry_at = 0.0
+    
+    def make_key(self, namespace: str, query: str, version: object, *extra: object) -> bytes:
+        """Build a key from the normalized query, versioned so a new corpus misses the old entries"""
+        normalized = " ".join(query.lower().split())
+        digest = hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+        suffix = ":".join(str(part) for part in (version, *extra))
+        return f"{namespace}:{digest}:{suffix}".encode()
+    
+    def get(self, key: bytes) -> Optional[bytes]:
+        """Return the cached bytes for a key, or None on a miss"""
+        if not self._available():
+            return None
+        try:
+            return self.client.get(key)
+        except redis.RedisError as e:
+            self._back_off(f"Response cache lookup failed: {str(e)}")
+            return None
+    
+    def set(self, key: bytes, value: bytes) -> None:
+        """Store bytes under a key with the configured TTL"""
+        if not self._available():
+            return
+        try:
+            self.client.setex(key, self.ttl, value)
+        except redis.RedisError as e:
+            self._back_off(f"Response cache store failed: {str(e)}")
+    
+    def _available(self) -> bool:
+        return self.client is not None and time.monotonic() >= self._retry_at
+    
+    def _back_off(self, message: str) -> None:
+        self._retry_at = time.monotonic() + REDIS_COOLDOWN
+        logger.warning(f"{message}; skipping Redis for {REDIS_COOLDOWN}s")
@@ -0,0 +1,124 @@
+import logging
+import os
+import pickle
+import threading
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Rows dequantized at a time during a lookup; small blocks keep the float32 copy in cache
+_LOOKUP_BLOCK_ROWS = 128
+
+def _quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric int8 codes and per-row float32 scales, so a row is approximately codes * scale"""
+    scales = np.abs(vectors).max(axis=-1, keepdims=True) / 127
+    scales[scales == 0] = 1
+    codes = np.round(vectors / scales).astype(np.int8)
+    return codes, scales[..., 0].astype(np.float32)
+
+class SemanticCache:
+    """
+    Cache of generated answers keyed by question embedding and an exact partition key.
+    A lookup returns the answer stored under the same key for the most similar
+    cached question when their cosine similarity reaches the threshold.
+    Embeddings are stored as int8 codes with a scale per row, a quarter of their float32 size.
+    """
+    
+    def __init__(self, dim: int = 1536, threshold: float = 0.95, max_size: int = 10000):
+        self.dim = dim
+        self.threshold = threshold
+        self.max_size = max_size
+        # Quantized unit-normalized rows, so a scaled dot product is the cosine similarity
+        self._codes = np.zeros((max_size, dim), dtype=np.int8)
+        self._scales = np.zeros(max_size, dtype=np.float32)
+        self._entries: List[Dict] = []
+        self._keys: List[str] = []
+        self._next_slot = 0
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def _normalize(self, embedding: List[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        if vector.shape != (self.dim,):
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+    
+    def lookup(self, embedding: List[float], key: str) -> Optional[Dict]:
+        """Return the cached answer for the nearest question under `key`, or None below the threshold"""
+        vector = self._normalize(embedding)
+        with self._lock:
+            if vector is None or not self._entries:
+                return None
+            count = len(self._entries)
+            similarities = np.empty(count, dtype=np.float32)
+            for start in range(0, count, _LOOKUP_BLOCK_ROWS):
+                stop = min(start + _LOOKUP_BLOCK_ROWS, count)
+                similarities[start:stop] = self._codes[start:stop].astype(np.float32) @ vector
+            similarities *= self._scales[:count]
+            # Few rows clear the threshold, so check their keys from the most similar down
+            candidates = np.flatnonzero(similarities >= self.threshold)
+            for i in candidates[np.argsort(-similarities[candidates])]:
+                if self._keys[i] == key:
+                    return dict(self._entries[i])
+            return None
+    
+    def add(self, embedding: List[float], result: Dict, key: str) -> None:
+        """Store an answer under `key`; once full, the oldest entry is overwritten"""
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        codes, scale = _quantize(vector)
+        with self._lock:
+            slot = self._next_slot
+            self._codes[slot] = codes
+            self._scales[slot] = scale
+            if slot < len(self._entries):
+                self._entries[slot] = dict(result)
+                self._keys[slot] = key
+            else:
+                self._entries.append(dict(result))
+                self._keys.append(key)
+            self._next_slot = (slot + 1) % self.max_size
+    
+    def save(self, path: str) -> None:
+        """Persist the cached embeddings and answers to a pickle file"""
+        with self._lock:
+            state = {
+                'dim': self.dim,
+                'codes': self._codes[:len(self._entries)].copy(),
+                'scales': self._scales[:len(self._entries)].copy(),
+                'entries': list(self._entries),
+                'keys': list(self._keys),
+                'next_slot': self._next_slot
+            }
+        with open(path, 'wb') as f:
+            pickle.dump(state, f)
+        logger.info(f"Saved {len(state['entries'])} semantic cache entries to {path}")
+    
+    def load(self, path: str) -> None:
+        """Restore entries saved with `save`, keeping the current threshold and size"""
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('dim') != self.dim:
+            logger.warning(f"Ignoring semantic cache {path}: dimension {state.get('dim')} != {self.dim}")
+            return
+        if 'keys' not in state:
+            # Older caches can't tell which context or corpus an answer was generated for
+            logger.warning(f"Ignoring semantic cache {path}: saved without partition keys")
+            return
+        
+        entries = state['entries'][:self.max_size]
+        with self._lock:
+            self._codes[:len(entries)] = state['codes'][:len(entries)]
+            self._scales[:len(entries)] = state['scales'][:len(entries)]
+            self._entries = entries
+            self._keys = state['keys'][:len(entries)]
+            self._next_slot = state['next_slot'] % self.max_size if len(entries) == self.max_size else len(entries)
+        logger.info(f"Loaded {len(entries)} semantic cache entries from {path}")
@@ -0,0 +1,2 @@
+# Found by pytest from any working directory; its presence puts backend/ on sys.path
+# so the tests can import the app package
@@ -0,0 +1,82 @@
+import asyncio
+
+from app.services.async_batcher import AsyncBatcher
+
+
+class _RecordingBatcher(AsyncBatcher):
+    """AsyncBatcher that records the items of every batch it dispatches"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches = []
+
+    async def _dispatch(self, batch):
+        self.batches.append([item for item, _ in batch])
+        await super()._dispatch(batch)
+
+
+async def _double(item):
+    return item * 2
+
+
+def test_batch_closes_at_max_batch():
+    async def main():
+        batcher = _RecordingBatcher(_double, max_batch=2, batch_timeout=10)
+        # A full batch is sent without waiting for the timeout
+        results = await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(4))), 1)
+        return batcher.batches, results
+
+    batches, results = asyncio.run(main())
+
+    assert batches == [[0, 1], [2, 3]]
+    assert results == [0, 2, 4, 6]
+
+
+def test_batch_closes_at_batch_timeout():
+    async def main():
+        batcher = _RecordingBatcher(_double, max_batch=10, batch_timeout=0.05)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        result = await batcher.submit(21)
+        return batcher.batches, result, loop.time() - start
+
+    batches, result, elapsed = asyncio.run(main())
+
+    assert batches == [[21]]
+    assert result == 42
+    assert 0.05 <= elapsed < 1
+
+
+def test_cancelled_submitter_is_skipped():
+    async def main():
+        batcher = _RecordingBatcher(_double, max_batch=10, batch_timeout=0.05)
+        cancelled = asyncio.create_task(batcher.submit(1))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        result = await batcher.submit(2)
+        return batcher.batches, cancelled, result
+
+    batches, cancelled, result = asyncio.run(main())
+
+    assert batches == [[2]]
+    assert cancelled.cancelled()
+    assert result == 4
+
+
+def test_handler_error_reaches_only_its_caller():
+    async def handler(item):
+        if item == "bad":
+            raise ValueError(item)
+        return item.upper()
+
+    async def main():
+        batcher = _RecordingBatcher(handler, max_batch=3, batch_timeout=10)
+        return batcher.batches, await asyncio.gather(
+            batcher.submit("a"), batcher.submit("bad"), batcher.submit("b"), return_exceptions=True
+        )
+
+    batches, results = asyncio.run(main())
+
+    assert batches == [["a", "bad", "b"]]
+    assert results[0] == "A" and results[2] == "B"
+    assert isinstance(results[1], ValueError)
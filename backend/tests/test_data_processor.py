@@ -0,0 +1,50 @@
+from app.services.data_processor import DataProcessor
+
+
+def test_search_content_counts_every_hit_and_returns_the_top_limit(tmp_path):
+    processor = DataProcessor(str(tmp_path))
+    entries = processor.process_batch([
+        {"url": "1", "title": "Horus", "content": "The Warmaster turned on the Emperor.", "categories": []},
+        {"url": "2", "title": "Emperor", "content": "The Emperor, Master of Mankind.", "categories": []},
+        {"url": "3", "title": "Orks", "content": "Green and numerous.", "categories": []},
+    ])
+
+    total, results = processor.search_content(entries, "emperor", limit=1)
+
+    assert total == 2
+    assert [result["entry"]["url"] for result in results] == ["2"]
+    assert results[0]["matched_fields"] == ["title", "content"]
+    assert processor.search_content(entries, "emperor")[1][1]["matched_fields"] == ["content"]
+
+
+def test_derived_fields_are_rebuilt_on_load_rather_than_saved(tmp_path):
+    processor = DataProcessor(str(tmp_path))
+    entries = processor.process_batch([
+        {"url": "1", "title": "Space Marines", "content": "Angels of Death.", "categories": []},
+    ])
+
+    path = processor.save_processed_data(entries, "processed.json")
+
+    assert "_content_lc" not in open(path).read()
+    loaded = DataProcessor(str(tmp_path)).load_processed_data("processed.json")
+    assert loaded == entries
+
+
+def test_extract_key_terms_finds_overlapping_terms(tmp_path):
+    processor = DataProcessor(str(tmp_path))
+
+    # 'Ork' ends on the 'k' that starts 'Knight'
+    assert processor.extract_key_terms("The warriorknight of the Imperium") == ["Ork", "Knight"]
+
+
+def test_parquet_round_trip_keeps_columns_missing_from_the_first_entry(tmp_path):
+    processor = DataProcessor(str(tmp_path))
+    old_entry = {"url": "1", "title": "Horus", "content": "Warmaster.", "main_category": "General", "key_terms": []}
+    new_entry = {**old_entry, "url": "2", "has_infobox": True, "infobox_data": {"Allegiance": "Chaos"}}
+
+    processor.save_processed_data([old_entry, new_entry], "processed.parquet")
+    loaded = DataProcessor(str(tmp_path)).load_processed_data("processed.parquet")
+
+    assert loaded[0]["has_infobox"] is None and loaded[0]["infobox_data"] is None
+    assert loaded[1]["has_infobox"] is True
+    assert loaded[1]["infobox_data"] == {"Allegiance": "Chaos"}
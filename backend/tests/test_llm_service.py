@@ -0,0 +1,108 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.services import llm_service
+from app.services.llm_service import LLMService
+
+
+def test_phrase_match_on_question_words_inside_longer_words(monkeypatch):
+    # "space marine" is a substring of "space marines", though "marine" is not a token there
+    monkeypatch.setattr(llm_service, "PHRASE_WEIGHT", 1000)
+    knowledge_base = [
+        {"title": "Astartes", "content": "The space marines are elite..."},
+        {"title": "Notes", "content": "space and marine stuff, marines space."},
+    ]
+
+    context = LLMService().find_relevant_context("space marine", knowledge_base)
+
+    assert context.startswith("Title: Astartes\n")
+
+
+class _FakeEmbeddings:
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, model, input):
+        self.calls += 1
+        data = [SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+        return SimpleNamespace(data=data[::-1])
+
+
+def test_agenerate_embeddings_batch_runs_inside_an_event_loop():
+    service = LLMService(api_key="test")
+    service._aclient = SimpleNamespace(embeddings=_FakeEmbeddings())
+    texts = ["x" * (i % 7) for i in range(600)]
+
+    embeddings = asyncio.run(service.agenerate_embeddings_batch(texts, batch_size=512))
+
+    assert embeddings == [[float(len(text))] for text in texts]
+    assert service._aclient.embeddings.calls == 2
+
+
+class _FakeCompletions:
+    """Chat completions that wait until released, counting the calls made"""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def create(self, model, messages, max_tokens, temperature):
+        self.calls += 1
+        await self.release.wait()
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="The Emperor protects."))])
+
+
+def test_identical_concurrent_answers_share_one_completion_despite_a_cancelled_caller():
+    service = LLMService(api_key="test")
+    completions = _FakeCompletions()
+    service._aclient = SimpleNamespace(embeddings=_FakeEmbeddings(), chat=SimpleNamespace(completions=completions))
+
+    async def main():
+        callers = [
+            asyncio.create_task(service.agenerate_enhanced_answer("Who is the Emperor?", "context", model="gpt-4"))
+            for _ in range(3)
+        ]
+        while not completions.calls:
+            await asyncio.sleep(0.01)
+        callers[0].cancel()
+        completions.release.set()
+        return await asyncio.gather(*callers, return_exceptions=True)
+
+    first, *rest = asyncio.run(main())
+
+    assert completions.calls == 1
+    assert isinstance(first, asyncio.CancelledError)
+    assert [result["answer"] for result in rest] == ["The Emperor protects."] * 2
+
+
+class _FakeStreamingCompletions:
+    def __init__(self, deltas):
+        self.deltas = deltas
+
+    async def create(self, model, messages, max_tokens, temperature, stream):
+        async def chunks():
+            for delta in self.deltas:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=delta))])
+        return chunks()
+
+
+def test_stream_releases_its_completion_slot_before_the_client_reads_every_chunk():
+    service = LLMService(api_key="test", max_concurrency=1)
+    completions = _FakeStreamingCompletions(["The ", "Emperor ", "protects."])
+    service._aclient = SimpleNamespace(embeddings=_FakeEmbeddings(), chat=SimpleNamespace(completions=completions))
+
+    async def main():
+        events = service.astream_answer("Who is the Emperor?", "context")
+        first = await events.__anext__()
+        # The client stalls after one chunk; the completion has still been read in full
+        await asyncio.sleep(0.01)
+        released = not service._completion_semaphore.locked()
+        rest = [event async for event in events]
+        return first, released, rest
+
+    first, released, rest = asyncio.run(main())
+
+    assert first == {"delta": "The "}
+    assert released
+    assert [event["delta"] for event in rest[:-1]] == ["Emperor ", "protects."]
+    assert "confidence" in rest[-1]
@@ -0,0 +1,18 @@
+import hashlib
+
+from app.services.llm_service import SYSTEM_PROMPT, SYSTEM_PROMPT_ENHANCED
+
+# The system prompts open every chat request, and OpenAI's prompt cache matches on an exact
+# token prefix. Editing them invalidates the cache, so update these hashes deliberately.
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def test_system_prompt_is_unchanged():
+    assert _sha256(SYSTEM_PROMPT) == "9c5ff7d70913469d7c3ac1f53b5f5ac56e0e9248c7391196b25e500a32960ef7"
+
+
+def test_enhanced_system_prompt_is_unchanged():
+    assert _sha256(SYSTEM_PROMPT_ENHANCED) == "d87d84ee5102df2d32081a9d201167343cd4bda17f871661a4eb6ad7bd5cb767"
@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+import redis
+
+from app.services import response_cache
+from app.services.response_cache import ResponseCache
+
+
+class _FailingClient:
+    def __init__(self):
+        self.calls = 0
+
+    def get(self, key):
+        self.calls += 1
+        raise redis.ConnectionError("unreachable")
+
+    def setex(self, key, ttl, value):
+        self.calls += 1
+        raise redis.TimeoutError("timed out")
+
+
+def test_redis_is_skipped_for_a_cooldown_after_an_error(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    cache = ResponseCache(url="redis://localhost:6379/0")
+    cache.client = _FailingClient()
+
+    assert cache.get(b"key") is None
+    cache.set(b"key", b"value")
+    assert cache.get(b"key") is None
+    assert cache.client.calls == 1
+
+    now[0] += response_cache.REDIS_COOLDOWN
+    cache.set(b"key", b"value")
+    assert cache.client.calls == 2
+
+
+def test_connections_use_short_timeouts():
+    cache = ResponseCache(url="redis://localhost:6379/0")
+
+    kwargs = cache.client.connection_pool.connection_kwargs
+    assert kwargs["socket_connect_timeout"] == response_cache.REDIS_TIMEOUT
+    assert kwargs["socket_timeout"] == response_cache.REDIS_TIMEOUT
@@ -6,15 +6,19 @@ This script scrapes key pages to populate the knowledge base
 
 import sys
 import os
+import argparse
 import asyncio
 import logging
 from pathlib import Path
 
+import orjson
+
 # Add the backend directory to the Python path
 sys.path.append(str(Path(__file__).parent.parent / "backend"))
 
 from app.scrapers.lexicanum_scraper import LexicanumScraper
 from app.services.data_processor import DataProcessor
+from app.services.llm_service import LLMService
 
 # Configure logging
 logging.basicConfig(
@@ -47,49 +51,83 @@ KEY_PAGES = [
     "https://wh40k.lexicanum.com/wiki/Terminator_Armour"
 ]
 
-async def collect_initial_data():
+# Number of scraped pages processed together while scraping continues
+PROCESS_CHUNK_SIZE = 8
+
+async def collect_initial_data(embed: bool = False):
     """Collect initial data from key Lexicanum pages"""
     
     logger.info("Starting initial data collection...")
     
     # Initialize services
-    scraper = LexicanumScraper(delay=2.0)  # 2 second delay to be respectful
+    # At most one request every 2 seconds to Lexicanum, with up to 5 pages in flight
+    scraper = LexicanumScraper(delay=2.0, concurrency=5)
     processor = DataProcessor()
     
     scraped_entries = []
+    processed_entries = []
+    # Pages waiting to be processed; bounded so scraping can't run far ahead of processing
+    queue: asyncio.Queue = asyncio.Queue(maxsize=4)
     
-    # Scrape each key page
-    for i, url in enumerate(KEY_PAGES, 1):
-        logger.info(f"Scraping {i}/{len(KEY_PAGES)}: {url}")
-        
-        try:
-            page_data = scraper.scrape_page(url)
+    async def produce():
+        """Scrape the key pages concurrently and queue each one as it arrives"""
+        async for url, page_data in scraper.iter_scraped_pages(KEY_PAGES):
             if page_data:
-                scraped_entries.append(page_data)
                 logger.info(f"✓ Successfully scraped: {page_data['title']}")
+                await queue.put(page_data)
             else:
                 logger.warning(f"✗ Failed to scrape: {url}")
-                
-        except Exception as e:
-            logger.error(f"✗ Error scraping {url}: {str(e)}")
-            continue
+        await queue.put(None)  # No more pages
+    
+    async def consume():
+        """Process queued pages in chunks while the remaining pages are still downloading"""
+        buffer = []
+        while True:
+            page_data = await queue.get()
+            if page_data is not None:
+                scraped_entries.append(page_data)
+                buffer.append(page_data)
+            if buffer and (page_data is None or len(buffer) >= PROCESS_CHUNK_SIZE):
+                processed_entries.extend(await asyncio.to_thread(processor.process_batch, buffer))
+                buffer = []
+            if page_data is None:
+                return
+    
+    logger.info(f"Scraping {len(KEY_PAGES)} pages...")
+    await asyncio.gather(produce(), consume())
     
     if not scraped_entries:
         logger.error("No data was successfully scraped!")
         return False
     
     # Save raw scraped data
+    scraper.scraped_data = scraped_entries
     raw_filename = scraper.save_data("initial_collection_raw.json")
     logger.info(f"Saved {len(scraped_entries)} raw entries to {raw_filename}")
     
-    # Process the data
-    logger.info("Processing scraped data...")
-    processed_entries = processor.process_batch(scraped_entries)
-    
     # Save processed data
     processed_filename = processor.save_processed_data(processed_entries, "processed_data_latest.json")
     logger.info(f"Saved {len(processed_entries)} processed entries to {processed_filename}")
     
+    llm_service = LLMService()
+    
+    # Vectorize the knowledge base once so the API can load it instead of re-tokenizing
+    llm_service.save_kb_index(processed_entries, os.path.join(processor.data_dir, "kb_index"))
+    
+    if embed:
+        # Embed entries through the Batch API, which is cheaper but not interactive
+        logger.info(f"Embedding {len(processed_entries)} entries with the OpenAI Batch API...")
+        embeddings = await asyncio.to_thread(
+            llm_service.generate_embeddings_batch_api,
+            {entry['url']: entry['content'] for entry in processed_entries if entry['content']},
+            os.path.join(processor.data_dir, "batch_input.jsonl")
+        )
+        # Kept apart from the processed data, which every API process parses on startup
+        embeddings_filename = os.path.join(processor.data_dir, "embeddings.json")
+        with open(embeddings_filename, 'wb') as f:
+            f.write(orjson.dumps(embeddings))
+        logger.info(f"Saved embeddings for {len(embeddings)} entries to {embeddings_filename}")
+    
     # Get and display statistics
     stats = processor.get_processing_statistics(processed_entries)
     
@@ -104,12 +142,19 @@ async def collect_initial_data():
 
 def main():
     """Main function"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--embed", action="store_true",
+        help="also embed the processed entries with the OpenAI Batch API (may take up to 24 hours)"
+    )
+    args = parser.parse_args()
+    
     try:
         # Create data directory
         os.makedirs("data", exist_ok=True)
         
         # Run the data collection
-        success = asyncio.run(collect_initial_data())
+        success = asyncio.run(collect_initial_data(embed=args.embed))
         
         if success:
             print("\n🎉 Initial data collection completed successfully!")